@@ -1,7 +1,6 @@
 # Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved. 
 from flask_restx import Resource, Namespace
 
-from shared.ot_logging import SoaLogger as Log
 from shared.utils import global_stack_context
 from shared.rest_data_models import RECEIVED_REQUEST_GET, RECEIVED_REQUEST_POST
 from shared.rest_data_models import \
@@ -11,11 +10,12 @@ from shared.rest_data_models import \
     remove_inactive_request_model, \
     license_key_response_model, \
     update_licenses_response_model
-from shared.ot_logging import SoaLogger as Log
 from shared.utils import global_stack_context
 
+from ..core.log import log as Log
 from ..core.this_service import this_service
 from ..core.license_check import license_manager
+from ..core.refresh import refresh_scheduler
 from ..core.exceptions import CouldNotReachLicenseSpringException
 from ..core.exceptions import NotFoundException
 
@@ -46,6 +46,7 @@ class LicenseKey(Resource):
             responses={
                 418: 'Service enablement status prohibits acting on this request.',
                 500: 'Internal Error.',
+                502: 'Could not reach LicenseSpring',
                 499: 'Error writing key to file'
             })
     def post(self):
@@ -59,14 +60,18 @@ class LicenseKey(Resource):
 
             license_key = ns.payload["license_key"]
             Log.debug(
-                f'/add_license_key received.'
-                f'   license_key: {license_key}',
+                '/add_license_key received.'
+                '   license_key: {}',
+                license_key,
                 topic=RECEIVED_REQUEST_POST
             )
 
             # if success, return license key + 200
             # if fail, return error detail + 499
-            ret = license_manager.add_license_key(license_key)
+            try:
+                ret = license_manager.add_license_key(license_key)
+            except CouldNotReachLicenseSpringException:
+                return {"error_detail":'Could not reach LicenseSpring'}, 502
             if 'incorrect format' in ret:
                 return {"error_detail":ret}, 499
             elif ret == "key already registered" or "could not activate" in ret:
@@ -101,7 +106,7 @@ class RemoveInactive(Resource):
                 return ({}, 418)
 
             Log.debug(
-                f'/remove_inactive_licenses received.',
+                '/remove_inactive_licenses received.',
                 topic=RECEIVED_REQUEST_POST
             )
 
@@ -137,8 +142,9 @@ class RemoveKey(Resource):
 
             license_key = ns.payload['license_key']
             Log.debug(
-                f'/remove_license received.'
-                f'   license_key: {license_key}',
+                '/remove_license received.'
+                '   license_key: {}',
+                license_key,
                 topic=RECEIVED_REQUEST_POST
             )
 
@@ -151,14 +157,14 @@ class RemoveKey(Resource):
 
 
 ####################################################################################
-#                        Remove Inactive Licenses Command
+#                           Update Licenses Command
 ####################################################################################
 @ns.route('/update_licenses')
 class UpdateLicenses(Resource):
     @ns.expect(remove_inactive_request_model, validate=True)
     @ns.marshal_with(update_licenses_response_model, skip_none=True)
     @ns.doc(
-        'POST to update all licenses registered on QuikStation',
+        'POST to start an update of all licenses registered on QuikStation',
         responses={
             418: 'Service enablement status prohibits acting on this request.',
             404: 'File not found',
@@ -168,6 +174,8 @@ class UpdateLicenses(Resource):
     def post(self):
         """
         Update all licenses registered on QuikStation
+        Licenses are refreshed in the background by the refresh scheduler, this returns
+        as soon as the update has been started
         :return:
         """
         with global_stack_context():
@@ -175,11 +183,11 @@ class UpdateLicenses(Resource):
             if not this_service.respond_to_get_statuses():
                 return ({}, 418)
             Log.debug(
-                f'/update_licenses received.',
+                '/update_licenses received.',
                 topic=RECEIVED_REQUEST_POST
             )
 
-            updated = license_manager.update_licenses()
+            updated = refresh_scheduler.trigger()
             if "successfully" in updated:
                 return {'response':updated}, 200
             return {'error_detail':'server error'}, 500
\ No newline at end of file
@@ -1,10 +1,17 @@
 # Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import queue
+import threading
+
 from flask_restx import Resource, Namespace
 
 from shared.rest_data_models import broadcast_event_model
 from shared.utils import global_stack_context
 
+from ..core.log import log as Log
 from ..core.this_service import this_service
+from ..core.license_check import license_manager
+from ..core.refresh import refresh_scheduler
+from ..core.log_topics import INTERNALDATA
 
 # There is always one API where events are received.  All events show up there and the handler in that API needs to
 # decide which to respond to and how, and which to simply ignore (which will typically be 'most of them')
@@ -15,6 +22,84 @@ from ..core.this_service import this_service
 ns = Namespace('Event Reception', description='API to receive all QuikStation broadcast events')
 broadcast_event_model.register_model_with_namespace(ns)
 
+
+#
+# Actions taken on events.  They run on the event thread, never in the request that delivered the event.
+#
+def retry_unreachable():
+    """
+    The network is back: let the circuit breaker try LicenseSpring right away and refresh
+    the keys that failed while it was down
+    """
+    if license_manager.api_client is not None:
+        license_manager.api_client.breaker.probe_now()
+    refresh_scheduler.retry_now()
+
+
+def reload_catalog():
+    """
+    Configuration changed: rebuild the behavior catalog from soa.yaml and republish the licenses against it.
+    Cached responses and ETags follow the state version this bumps
+    """
+    license_manager.reload_catalog()
+
+
+#
+# Routing table.  Maps (sending service, event) to the action it triggers, anything not listed is ignored.
+#
+ROUTES = {
+    ('network_manager', 'connectivity_restored'): retry_unreachable,
+    ('config_manager', 'config_changed'): reload_catalog,
+}
+
+
+class EventQueue:
+    """
+    Runs event actions on a background thread, so the sender's 200 never waits on LicenseSpring. \n
+    An action already waiting in the queue is not queued again, a burst of the same event runs it once
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, action):
+        '''
+        :param action: function from ROUTES
+        :return: Boolean, False if the action was already waiting
+        '''
+        with self.lock:
+            if action in self.pending:
+                return False
+            self.pending.add(action)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='license_event_actions', daemon=True)
+                self.thread.start()
+        self.queue.put(action)
+        return True
+
+    def run(self):
+        while True:
+            action = self.queue.get()
+            with self.lock:
+                self.pending.discard(action)
+            try:
+                action()
+            except Exception as e:
+                Log.warning(
+                    'Event action failed.'
+                    '   Action: {}'
+                    '   Exception: {}',
+                    action.__name__,
+                    e,
+                    topic=INTERNALDATA
+                )
+
+
+event_queue = EventQueue()
+
+
 #
 # Standard incoming event endpoint.  Note: the '/broadcast-event' address is a global design requirement.
 #
@@ -33,13 +118,24 @@ class EventListener(Resource):
             # We are validating against a model with required fields, so we know these are present.
             #
             sending_service = ns.payload['service']
+            event = ns.payload.get('event')
 
             #
             # this is where we look for events we care about and invoke logic because they happened.
             #
-            # Example (remove this once if/when there's actual code here.)
-            #     if sending_service == 'pt_dock_manager' and sending_ns == 'cart_info':
-            #         do_something()
+            action = ROUTES.get((sending_service, event))
+            if action is not None:
+                Log.debug(
+                    'Event routed.'
+                    '   Service: {}'
+                    '   Event: {}'
+                    '   Action: {}',
+                    sending_service,
+                    event,
+                    action.__name__,
+                    topic=INTERNALDATA
+                )
+                event_queue.put(action)
 
             # Return is always 200 for events because the sender doesn't really care anyway.
             return({}, 200)
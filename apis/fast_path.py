@@ -0,0 +1,103 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import json
+import time
+
+from shared.rest_data_models import RECEIVED_REQUEST_GET
+
+from ..core.log import log as Log
+from ..core.this_service import this_service
+from ..core.license_check import license_manager
+from ..core.exceptions import CouldNotReachLicenseSpringException
+from ..core.exceptions import NotFoundException
+from ..core.metrics import metrics
+
+# GET <FAST_PATH_PREFIX><behavior_name> is answered by BehaviorFastPath before Flask sees the request.
+# Documented in the swagger spec by the FastBehavior resource in license_info.py
+FAST_PATH_PREFIX = '/licenseinfo/fast/'
+FAST_PATH_METRIC = 'http.GET /licenseinfo/fast/<behavior_name>'
+
+# the same bytes ByBehavior's marshalled answers serialize to
+PERMITTED = b'{"response": true}\n'
+NOT_PERMITTED = b'{"response": false}\n'
+NOT_ENABLED = b'{}\n'
+
+STATUS_LINES = {
+    200: '200 OK',
+    404: '404 NOT FOUND',
+    418: "418 I'M A TEAPOT",
+    500: '500 INTERNAL SERVER ERROR',
+    502: '502 BAD GATEWAY',
+}
+
+
+def error_body(detail):
+    return (json.dumps({'error_detail': str(detail)}) + '\n').encode()
+
+
+def answer_behavior(behavior_name):
+    '''
+    Answer a behavior check straight from the published entitlement state
+    :param behavior_name: String
+    :return: Tuple of (status code, response bytes)
+    '''
+    if not this_service.respond_to_get_statuses():
+        return 418, NOT_ENABLED
+
+    Log.debug(
+        '/fast behavior check received.'
+        '   behavior: {}',
+        behavior_name,
+        topic=RECEIVED_REQUEST_GET,
+        sample=True
+    )
+    # a defined behavior is answered with a set lookup. Anything else goes through check_behavior,
+    # so illegal and undefined names get exactly the 404s ByBehavior gives them
+    if behavior_name in license_manager.catalog_behaviors:
+        if behavior_name in license_manager.state.licensed_behaviors:
+            metrics.incr('check_behavior.granted')
+            return 200, PERMITTED
+        metrics.incr('check_behavior.denied')
+        return 200, NOT_PERMITTED
+    try:
+        is_permitted = license_manager.check_behavior(behavior_name)
+        return 200, PERMITTED if is_permitted else NOT_PERMITTED
+    except NotFoundException as ex:
+        return 404, error_body(ex)
+    except CouldNotReachLicenseSpringException as ex:
+        return 502, error_body(ex)
+    except:
+        return 500, error_body('server error')
+
+
+class BehaviorFastPath:
+    """
+    WSGI middleware answering GET /licenseinfo/fast/<behavior_name> without Flask routing, restx dispatch,
+    marshalling or global_stack_context. Every other request is passed on to the wrapped app. \n
+    The request is timed under the same metrics name Flask's instrumentation would give it; profiling
+    sessions don't see it
+    """
+    def __init__(self, app, prefix=FAST_PATH_PREFIX):
+        self.app = app
+        self.prefix = prefix
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('REQUEST_METHOD') != 'GET' or not path.startswith(self.prefix):
+            return self.app(environ, start_response)
+        behavior_name = path[len(self.prefix):]
+        if not behavior_name or '/' in behavior_name:
+            # not a route of ours, Flask gives the 404
+            return self.app(environ, start_response)
+
+        started = time.perf_counter()
+        if not behavior_name.isascii():
+            # WSGI hands the path over as latin-1, Flask decodes it as UTF-8
+            behavior_name = behavior_name.encode('latin-1').decode('utf-8', 'replace')
+        status, body = answer_behavior(behavior_name)
+        start_response(STATUS_LINES[status], [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        metrics.observe(FAST_PATH_METRIC, time.perf_counter() - started)
+        metrics.incr(f'{FAST_PATH_METRIC}.{status // 100}xx')
+        return [body]
@@ -1,5 +1,6 @@
 # Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
-from flask_restx import Resource, Namespace
+from flask import Response, request
+from flask_restx import Resource, Namespace, fields, marshal
 import json
 from shared.rest_data_models import RECEIVED_REQUEST_GET, RECEIVED_REQUEST_POST
 from shared.rest_data_models import \
@@ -7,13 +8,16 @@ from shared.rest_data_models import \
     key_response_model, \
     active_licenses_response_model, \
     features_model
-from shared.ot_logging import SoaLogger as Log
 from shared.utils import global_stack_context
 
+from ..core.log import log as Log
 from ..core.this_service import this_service
 from ..core.license_check import license_manager
+from ..core.license_check import MAX_BATCH_BEHAVIORS
 from ..core.exceptions import CouldNotReachLicenseSpringException
 from ..core.exceptions import NotFoundException
+from ..core.metrics import metrics
+from .fast_path import answer_behavior
 
 # There is always one API where events are received.  All events show up there and the handler in that API needs to
 # decide which to respond to and how, and which to simply ignore (which will typically be 'most of them')
@@ -37,6 +41,67 @@ key_response_model.register_model_with_namespace(ns)
 active_licenses_response_model.register_model_with_namespace(ns)
 features_model.register_model_with_namespace(ns)
 
+licensespring_status_model = ns.model('LicenseSpring Status', {
+    'state': fields.String(description='Circuit breaker state: closed, open or half_open'),
+    'consecutive_failures': fields.Integer(description='LicenseSpring calls that failed to connect in a row'),
+    'open_seconds': fields.Float(description='Seconds since the breaker opened, absent when closed'),
+    'outage_grace_seconds': fields.Integer(description='How long licenses keep their last known state while LicenseSpring is unreachable'),
+    'error_detail': fields.String
+})
+
+batch_behavior_request_model = ns.model('Batch Behavior Request', {
+    'behaviors': fields.List(fields.String, required=True, min_items=1, max_items=MAX_BATCH_BEHAVIORS,
+                             description='Behavior names to check')
+})
+batch_behavior_response_model = ns.model('Batch Behavior Response', {
+    'results': fields.Raw(description='Map of behavior name to whether it is permitted'),
+    'errors': fields.Raw(description='Map of behavior name to error detail, for undefined or illegal names'),
+    'error_detail': fields.String
+})
+
+
+class VersionedResponses:
+    """
+    Serialized GET responses, rebuilt only when license_manager.state_version moves. \n
+    Responses carry an ETag for the state version they were built from, so pollers sending
+    If-None-Match get a 304 with no body while nothing has changed
+    """
+    def __init__(self):
+        # maps "response name": (state version, serialized body)
+        self.cache = {}
+
+    def respond(self, name, build, model, **marshal_args):
+        '''
+        :param name: cache slot, one per endpoint
+        :param build: function returning the response dict, only called on a cache miss
+        :param model: restx model to marshal the response dict with
+        :return: flask Response
+        '''
+        # read the version before building, so a cached body is never older than its version
+        version = license_manager.state_version
+        etag = f'{license_manager.boot_id}-{version}'
+        if request.if_none_match.contains(etag):
+            metrics.incr('response_cache.not_modified')
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        cached = self.cache.get(name)
+        if cached is None or cached[0] != version:
+            metrics.incr('response_cache.miss')
+            body = json.dumps(marshal(build(), model, **marshal_args)) + '\n'
+            cached = (version, body.encode())
+            self.cache[name] = cached
+        else:
+            metrics.incr('response_cache.hit')
+
+        response = Response(cached[1], status=200, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+
+versioned_responses = VersionedResponses()
+
 
 ####################################################################################
 # Standard info get.  Requires a specific behavior name.
@@ -66,9 +131,11 @@ class ByBehavior(Resource):
                 return({}, 418)
 
             Log.debug(
-                f'/behavior check received.'
-                f'   behavior: {behavior_name}',
-                topic=RECEIVED_REQUEST_GET
+                '/behavior check received.'
+                '   behavior: {}',
+                behavior_name,
+                topic=RECEIVED_REQUEST_GET,
+                sample=True
             )
 
             try:
@@ -82,15 +149,118 @@ class ByBehavior(Resource):
                 return {'error_detail':'server error'}, 500
 
 
+####################################################################################
+# Fast behavior check.  Same answers as the standard get, for the hottest call.
+####################################################################################
+@ns.route('/fast/<behavior_name>')
+class FastBehavior(Resource):
+    @ns.response(200, 'Success', behavior_response_model)
+    @ns.doc(
+        'GET for license info, fast path',
+        responses={
+            418: 'Service enablement status prohibits acting on this request.',
+            404: 'Behavior not found',
+            502: 'Could not reach LicenseSpring',
+            500: 'Unknown server error - See detail.'
+        }
+    )
+    def get(self, behavior_name):
+        """
+        Check if access allowed for given behavior, answered with the same status codes and bodies as
+        /licenseinfo/<behavior_name>. BehaviorFastPath answers these requests before they reach Flask,
+        this handler only runs if it isn't installed
+        """
+        status, body = answer_behavior(behavior_name)
+        return Response(body, status=status, mimetype='application/json')
+
+
+####################################################################################
+# Batch behavior check.  Answers many behaviors in one round trip.
+####################################################################################
+@ns.route('/check_behaviors')
+class ByBehaviors(Resource):
+    @ns.expect(batch_behavior_request_model, validate=True)
+    # not marshalled: skip_none would drop an empty errors map, callers can rely on both maps being there
+    @ns.response(200, 'Success', batch_behavior_response_model)
+    @ns.doc(
+        'POST to check several behaviors at once',
+        responses={
+            418: 'Service enablement status prohibits acting on this request.',
+            500: 'Unknown server error - See detail.'
+        }
+    )
+    def post(self):
+        """
+        Check if access allowed for each given behavior
+        results maps each defined behavior to true/false
+        errors maps each undefined or illegal behavior to an error detail
+        """
+        with global_stack_context():
+
+            if not this_service.respond_to_get_statuses():
+                return ({}, 418)
+
+            behavior_names = ns.payload['behaviors']
+            Log.debug(
+                '/check_behaviors received.'
+                '   behaviors: {}',
+                behavior_names,
+                topic=RECEIVED_REQUEST_POST,
+                sample=True
+            )
+
+            try:
+                results, errors = license_manager.check_behaviors(behavior_names)
+                return {'results':results, 'errors':errors}, 200
+            except:
+                return {'error_detail':'server error'}, 500
+
+
+####################################################################################
+# LicenseSpring connection status
+####################################################################################
+@ns.route('/licensespring_status')
+class LicenseSpringStatus(Resource):
+    @ns.marshal_with(licensespring_status_model, skip_none=True)
+    @ns.doc(
+        'GET for LicenseSpring connection status',
+        responses={
+            418: 'Service enablement status prohibits acting on this request.',
+            500: 'Unknown server error - See detail.'
+        }
+    )
+    def get(self):
+        """
+        View the circuit breaker state of the connection to LicenseSpring
+        While the breaker is open, calls to LicenseSpring fail immediately and licenses keep
+        their last known state until the outage grace window runs out
+        """
+        with global_stack_context():
+
+            if not this_service.respond_to_get_statuses():
+                return ({}, 418)
+            Log.debug(
+                '/licensespring_status received.',
+                topic=RECEIVED_REQUEST_GET,
+                sample=True
+            )
+
+            try:
+                return license_manager.licensespring_status(), 200
+            except:
+                return {'error_detail': 'Server error'}, 500
+
+
 ####################################################################################
 # Get license keys
 ####################################################################################
 @ns.route('/view_license_keys')
 class ViewKeys(Resource):
-    @ns.marshal_with(key_response_model, skip_none=True)
+    @ns.response(200, 'Success', key_response_model)
     @ns.doc(
         'GET for license keys',
         responses={
+            304: 'Not modified since the ETag in If-None-Match.',
             418: 'Service enablement status prohibits acting on this request.',
             404: 'File not found',
             500: 'Unknown server error - See detail.'
@@ -105,22 +275,28 @@ class ViewKeys(Resource):
             if not this_service.respond_to_get_statuses():
                 return ({}, 418)
             Log.debug(
-                f'/view_license_keys received.',
-                topic=RECEIVED_REQUEST_GET
+                '/view_license_keys received.',
+                topic=RECEIVED_REQUEST_GET,
+                sample=True
             )
 
-            registered_keys = license_manager.get_keys()
-            return {'keys':registered_keys}, 200
+            return versioned_responses.respond(
+                'view_license_keys',
+                lambda: {'keys':license_manager.get_keys()},
+                key_response_model,
+                skip_none=True
+            )
 
 ####################################################################################
 # Get licensed features
 ####################################################################################
 @ns.route('/licensed_features')
 class LicensedFeatures(Resource):
-    @ns.marshal_with(features_model)
+    @ns.response(200, 'Success', features_model)
     @ns.doc(
         'GET for all licensed features and associated behaviors',
         responses={
+            304: 'Not modified since the ETag in If-None-Match.',
             418: 'Service enablement status prohibits acting on this request.',
             500: 'Unknown server error - See detail.'
         }
@@ -136,13 +312,17 @@ class LicensedFeatures(Resource):
             if not this_service.respond_to_get_statuses():
                 return ({}, 418)
             Log.debug(
-                f'/licensed_features received.',
-                topic=RECEIVED_REQUEST_GET
+                '/licensed_features received.',
+                topic=RECEIVED_REQUEST_GET,
+                sample=True
             )
 
             try:
-                features = license_manager.get_licensed_behaviors()
-                return features, 200
+                return versioned_responses.respond(
+                    'licensed_features',
+                    license_manager.get_licensed_behaviors,
+                    features_model
+                )
             except CouldNotReachLicenseSpringException as ex:
                 return {'error_detail': f'Error talking to LicenseSpring: {ex}'}, 502
             except:
@@ -154,10 +334,11 @@ class LicensedFeatures(Resource):
 ####################################################################################
 @ns.route('/active_licenses')
 class ActiveLicenses(Resource):
-    @ns.marshal_with(active_licenses_response_model, skip_none=True)
+    @ns.response(200, 'Success', active_licenses_response_model)
     @ns.doc(
         'GET for active licenses',
         responses={
+            304: 'Not modified since the ETag in If-None-Match.',
             418: 'Service enablement status prohibits acting on this request.',
             404: 'Keys not found',
             500: 'Unknown server error - See detail.'
@@ -172,13 +353,18 @@ class ActiveLicenses(Resource):
             if not this_service.respond_to_get_statuses():
                 return {}, 418
             Log.debug(
-                f'/active_licenses received.',
-                topic=RECEIVED_REQUEST_GET
+                '/active_licenses received.',
+                topic=RECEIVED_REQUEST_GET,
+                sample=True
             )
 
             try:
-                licenses = license_manager.get_active_licenses()
-                return {'licenses':licenses}, 200
+                return versioned_responses.respond(
+                    'active_licenses',
+                    lambda: {'licenses':license_manager.get_active_licenses()},
+                    active_licenses_response_model,
+                    skip_none=True
+                )
             except CouldNotReachLicenseSpringException as ex:
                 return {'error_detail': 'Error talking to LicenseSpring'}, 500
 
@@ -0,0 +1,230 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+#
+# Behavior checks over a Unix domain socket, for services on the same QuikStation. Skips Apache and HTTP,
+# answers come from the same license_manager state as the REST API.
+#
+# Every message is a frame: a 6 byte header, big-endian uint32 body length then uint16 status, and a UTF-8
+# JSON body. Status is 0 in requests. Connections are kept open for as many requests as the caller likes,
+# answered in order.
+#   {"behavior": "iscsi_targ"}              -> same status and body as GET /licenseinfo/<behavior_name>
+#   {"behaviors": ["iscsi_targ", ...]}      -> same status and body as POST /licenseinfo/check_behaviors,
+#                                              at most MAX_BATCH_BEHAVIORS names
+# Anything else is answered 400 with an error_detail.
+#
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+
+from shared.rest_data_models import RECEIVED_REQUEST_POST
+
+from ..core.log import log as Log
+from ..core.log_topics import ENABLEMENT
+from ..core.this_service import this_service
+from ..core.license_check import license_manager
+from ..core.license_check import MAX_BATCH_BEHAVIORS
+from ..core.metrics import metrics
+from .fast_path import answer_behavior, error_body, PERMITTED, NOT_PERMITTED, NOT_ENABLED
+
+HEADER = struct.Struct('>IH')
+# requests are a behavior name or a list of them, anything bigger is a broken or hostile caller
+MAX_REQUEST_BYTES = 64 * 1024
+
+# defaults for tunables that can be overridden in static_config.yaml
+DEFAULT_LOCAL_SOCKET_TIMEOUT = 30           # seconds a connection may sit without sending a whole request
+DEFAULT_LOCAL_SOCKET_CONNECTIONS = 64       # connections served at once, each holds a thread
+
+
+def frame(status, body):
+    return HEADER.pack(len(body), status) + body
+
+
+# the two answers nearly every request gets
+PERMITTED_FRAME = frame(200, PERMITTED)
+NOT_PERMITTED_FRAME = frame(200, NOT_PERMITTED)
+
+
+def answer(request):
+    '''
+    :param request: decoded request body
+    :return: response frame bytes
+    '''
+    if not isinstance(request, dict):
+        return frame(400, error_body('Request must be a JSON object'))
+
+    behavior_name = request.get('behavior')
+    if isinstance(behavior_name, str):
+        status, body = answer_behavior(behavior_name)
+        if body is PERMITTED:
+            return PERMITTED_FRAME
+        if body is NOT_PERMITTED:
+            return NOT_PERMITTED_FRAME
+        return frame(status, body)
+
+    behavior_names = request.get('behaviors')
+    if isinstance(behavior_names, list) and behavior_names and all(isinstance(b, str) for b in behavior_names):
+        if len(behavior_names) > MAX_BATCH_BEHAVIORS:
+            return frame(400, error_body(f'At most {MAX_BATCH_BEHAVIORS} behaviors per request'))
+        if not this_service.respond_to_get_statuses():
+            return frame(418, NOT_ENABLED)
+        Log.debug(
+            'local check_behaviors received.'
+            '   behaviors: {}',
+            behavior_names,
+            topic=RECEIVED_REQUEST_POST,
+            sample=True
+        )
+        try:
+            results, errors = license_manager.check_behaviors(behavior_names)
+        except:
+            return frame(500, error_body('server error'))
+        return frame(200, (json.dumps({'results': results, 'errors': errors}) + '\n').encode())
+
+    return frame(400, error_body('Request needs "behavior": name or "behaviors": [names]'))
+
+
+class LocalSocketHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        # a stalled caller gives its thread back after this long, the client reconnects on its next check
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def handle(self):
+        try:
+            self.serve()
+        except OSError:
+            # timed out or hung up mid frame
+            pass
+
+    def serve(self):
+        while True:
+            header = self.rfile.read(HEADER.size)
+            if len(header) < HEADER.size:
+                # caller hung up
+                return
+            length, _ = HEADER.unpack(header)
+            if length > MAX_REQUEST_BYTES:
+                self.wfile.write(frame(400, error_body(f'Request over {MAX_REQUEST_BYTES} bytes')))
+                return
+            payload = self.rfile.read(length)
+            if len(payload) < length:
+                return
+
+            started = time.perf_counter()
+            try:
+                request = json.loads(payload)
+            except ValueError:
+                response = frame(400, error_body('Request is not JSON'))
+            else:
+                response = answer(request)
+            self.wfile.write(response)
+            status = HEADER.unpack_from(response)[1]
+            metrics.observe('local_socket.request', time.perf_counter() - started)
+            metrics.incr(f'local_socket.request.{status // 100}xx')
+
+
+class LocalSocketServer(socketserver.ThreadingUnixStreamServer):
+    """
+    A thread per connection, up to max_connections. Connections beyond that are answered 503 and closed
+    """
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout, max_connections):
+        super().__init__(path, LocalSocketHandler)
+        self.idle_timeout = idle_timeout
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            try:
+                request.sendall(frame(503, error_body('Too many connections')))
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            metrics.incr('local_socket.refused')
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+def in_use(path):
+    '''
+    Whether a listener is answering on the socket at path
+    '''
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(1)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class LocalListener:
+    """
+    Serves the local socket on a background thread. \n
+    Only the process that refreshes licenses listens, so processes sharing license state never race
+    for the socket path
+    """
+    def __init__(self):
+        self.server = None
+        self.path = None
+
+    def start(self, path, idle_timeout=DEFAULT_LOCAL_SOCKET_TIMEOUT, max_connections=DEFAULT_LOCAL_SOCKET_CONNECTIONS):
+        '''
+        Listen on path, replacing a socket left behind by an earlier process.
+        A socket some other listener still answers on is left alone
+        :param idle_timeout: seconds a connection may wait between or within requests
+        :param max_connections: connections served at once
+        :return: True if listening, False if the socket couldn't be created (the REST API still works)
+        '''
+        if self.server is not None:
+            return True
+        try:
+            if stat.S_ISSOCK(os.lstat(path).st_mode):
+                if in_use(path):
+                    Log.warning('Local socket already served by another process.   Path: {}', path, topic=ENABLEMENT)
+                    return False
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        try:
+            server = LocalSocketServer(path, idle_timeout, max_connections)
+            # as open to local callers as the REST port is
+            os.chmod(path, 0o666)
+        except OSError as e:
+            Log.warning('Local socket not available.   Path: {}   Exception: {}', path, e, topic=ENABLEMENT)
+            return False
+        self.server = server
+        self.path = path
+        threading.Thread(target=server.serve_forever, name='local_socket', daemon=True).start()
+        Log.info('Behavior checks served on {}', path, topic=ENABLEMENT)
+        return True
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.server = None
+
+
+#
+# Importable instance.  Import this wherever we need it in the service.
+#
+local_listener = LocalListener()
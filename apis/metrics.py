@@ -0,0 +1,92 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+from flask_restx import Resource, Namespace, fields
+from shared.rest_data_models import RECEIVED_REQUEST_GET
+from shared.utils import global_stack_context
+
+from ..core.log import log as Log
+from ..core.this_service import this_service
+from ..core.license_check import license_manager
+from ..core.metrics import metrics
+from ..core.refresh import refresh_scheduler
+
+description = """
+Runtime metrics of the License Manager
+"""
+
+##############################################################################################
+# Counters and latency histograms kept in memory since the service started.  Always on.
+##############################################################################################
+
+ns = Namespace('Metrics', description=description)
+
+metrics_model = ns.model('Metrics', {
+    'uptime_seconds': fields.Integer(description='Seconds since metrics were started'),
+    'state': fields.Raw(description='Current license state: version, boot_id, license and behavior counts'),
+    'ratios': fields.Raw(description='check_behavior granted ratio and response cache hit ratios'),
+    'licensespring': fields.Raw(description='Circuit breaker state and retry budget'),
+    'last_refresh': fields.Raw(description='Last license refresh: when, how long, keys refreshed, '
+                                           'map of changed key to change details, keys that failed'),
+    'counters': fields.Raw(description='Map of counter name to count'),
+    'histograms': fields.Raw(description='Map of histogram name to count, sum, max, percentiles and buckets (seconds)'),
+    'error_detail': fields.String
+})
+
+
+def collect():
+    '''
+    Metrics snapshot plus the current state of license_manager
+    :return: dict
+    '''
+    snapshot = metrics.snapshot()
+    state = license_manager.state
+    snapshot['state'] = {
+        'version': state.version,
+        'boot_id': license_manager.boot_id,
+        'licenses': len(state.licenses),
+        'active_licenses': sum(1 for license_obj in state.licenses.values() if license_obj.active),
+        'licensed_behaviors': len(state.licensed_behaviors),
+    }
+    snapshot['ratios'] = {
+        'check_behavior_granted': metrics.ratio('check_behavior.granted', 'check_behavior.denied', snapshot['counters']),
+        'response_cache_hit': metrics.ratio('response_cache.hit', 'response_cache.miss', snapshot['counters']),
+        'response_cache_not_modified': metrics.ratio('response_cache.not_modified', 'response_cache.miss', snapshot['counters']),
+    }
+    licensespring = license_manager.licensespring_status()
+    if license_manager.api_client is not None and hasattr(license_manager.api_client, 'retry_budget'):
+        licensespring['retry_budget_tokens'] = round(license_manager.api_client.retry_budget.tokens, 2)
+    snapshot['licensespring'] = licensespring
+    snapshot['last_refresh'] = refresh_scheduler.last_run
+    return snapshot
+
+
+####################################################################################
+# Get metrics
+####################################################################################
+@ns.route('')
+class Metrics(Resource):
+    @ns.marshal_with(metrics_model, skip_none=True)
+    @ns.doc(
+        'GET for runtime metrics',
+        responses={
+            418: 'Service enablement status prohibits acting on this request.',
+            500: 'Unknown server error - See detail.'
+        }
+    )
+    def get(self):
+        """
+        View request latencies per endpoint, LicenseSpring call latencies and errors per operation
+        and product, behavior check and cache ratios, refresh durations and the state version
+        """
+        with global_stack_context():
+
+            if not this_service.respond_to_get_statuses():
+                return ({}, 418)
+            Log.debug(
+                '/metrics received.',
+                topic=RECEIVED_REQUEST_GET
+            )
+
+            try:
+                return collect(), 200
+            except:
+                return {'error_detail': 'Server error'}, 500
@@ -0,0 +1,203 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+from flask import Response, request
+from flask_restx import Resource, Namespace, fields
+from shared.rest_data_models import RECEIVED_REQUEST_GET, RECEIVED_REQUEST_POST
+from shared.local_config import read_local_static_config
+from shared.utils import global_stack_context
+
+from ..core.log import log as Log
+from ..core.license_check import license_manager
+from ..core.profiling import profiler, ROUTES, LICENSESPRING
+
+description = """
+Admin only: on-demand profiling of live requests and LicenseSpring calls
+"""
+
+##############################################################################################
+# Profiling sessions cost nothing until started here, and stop by themselves after the
+# requested number of calls or seconds.  Off unless profiling_enabled is set in static config,
+# then only answered for admin addresses (loopback by default).
+##############################################################################################
+
+ns = Namespace('Admin - Profiling', description=description)
+
+DEFAULT_ALLOWED_ADDRESSES = ['127.0.0.1', '::1']
+
+profiling_request_model = ns.model('Profiling Request', {
+    'target': fields.String(required=True, enum=[ROUTES, LICENSESPRING],
+                            description='Profile requests to the service, or calls to LicenseSpring'),
+    'route': fields.String(description='Route template to profile, e.g. /licenseinfo/<behavior_name>. All routes if absent'),
+    'requests': fields.Integer(min=1, description='Stop after profiling this many calls'),
+    'seconds': fields.Integer(min=1, description='Stop after this many seconds'),
+    'sample_every': fields.Integer(min=1, description='Profile one call in this many, default every call'),
+    'memory': fields.Boolean(description='Also trace memory allocations (tracemalloc), slows everything down while on')
+})
+profiling_status_model = ns.model('Profiling Status', {
+    'active': fields.Boolean,
+    'target': fields.String,
+    'route': fields.String,
+    'profiled': fields.Integer(description='Calls profiled so far'),
+    'seen': fields.Integer(description='Matching calls seen, profiled or not'),
+    'memory': fields.Boolean,
+    'remaining': fields.Integer(description='Calls left to profile'),
+    'seconds_left': fields.Float,
+    'error_detail': fields.String
+})
+
+
+def refusal():
+    '''
+    Why this request may not use profiling. Loopback alone can't be trusted, every service on the box and
+    everything the local Apache proxies comes from there, so profiling has to be switched on first
+    :return: error detail, None if allowed
+    '''
+    if not read_local_static_config('profiling_enabled'):
+        return 'Profiling is disabled, set profiling_enabled in static config'
+    allowed = read_local_static_config('profiling_allowed_addresses') or DEFAULT_ALLOWED_ADDRESSES
+    if request.remote_addr not in allowed:
+        return 'Admin only'
+    return None
+
+
+####################################################################################
+# Start a profiling session
+####################################################################################
+@ns.route('/start')
+class StartProfiling(Resource):
+    @ns.expect(profiling_request_model, validate=True)
+    @ns.marshal_with(profiling_status_model, skip_none=True)
+    @ns.doc(
+        'POST to start profiling',
+        responses={
+            403: 'Profiling disabled, or not an admin address.',
+            400: 'Bad request - See detail.',
+            500: 'Unknown server error - See detail.'
+        }
+    )
+    def post(self):
+        """
+        Profile the next requests to a route, or the next LicenseSpring calls, with cProfile.
+        Replaces the results of any earlier session
+        """
+        with global_stack_context():
+
+            refused = refusal()
+            if refused:
+                return {'error_detail': refused}, 403
+            Log.debug(
+                '/admin/profiling/start received.'
+                '   Request: {}',
+                ns.payload,
+                topic=RECEIVED_REQUEST_POST
+            )
+
+            try:
+                return profiler.start(
+                    ns.payload['target'],
+                    route=ns.payload.get('route'),
+                    requests=ns.payload.get('requests'),
+                    seconds=ns.payload.get('seconds'),
+                    sample_every=ns.payload.get('sample_every'),
+                    memory=ns.payload.get('memory', False)
+                ), 200
+            except ValueError as ex:
+                return {'error_detail': str(ex)}, 400
+            except:
+                return {'error_detail': 'Server error'}, 500
+
+
+####################################################################################
+# Stop the profiling session
+####################################################################################
+@ns.route('/stop')
+class StopProfiling(Resource):
+    @ns.marshal_with(profiling_status_model, skip_none=True)
+    @ns.doc(
+        'POST to stop profiling',
+        responses={
+            403: 'Profiling disabled, or not an admin address.'
+        }
+    )
+    def post(self):
+        """
+        Stop profiling now, the results stay available from /report
+        """
+        with global_stack_context():
+
+            refused = refusal()
+            if refused:
+                return {'error_detail': refused}, 403
+            Log.debug(
+                '/admin/profiling/stop received.',
+                topic=RECEIVED_REQUEST_POST
+            )
+            return profiler.stop(), 200
+
+
+####################################################################################
+# Profiling status
+####################################################################################
+@ns.route('/status')
+class ProfilingStatus(Resource):
+    @ns.marshal_with(profiling_status_model, skip_none=True)
+    @ns.doc(
+        'GET for the profiling session status',
+        responses={
+            403: 'Profiling disabled, or not an admin address.'
+        }
+    )
+    def get(self):
+        """
+        View whether a profiling session is running and how far along it is
+        """
+        with global_stack_context():
+
+            refused = refusal()
+            if refused:
+                return {'error_detail': refused}, 403
+            Log.debug(
+                '/admin/profiling/status received.',
+                topic=RECEIVED_REQUEST_GET
+            )
+            return profiler.status(), 200
+
+
+####################################################################################
+# Download the profiling report
+####################################################################################
+@ns.route('/report')
+class ProfilingReport(Resource):
+    @ns.doc(
+        'GET for the profiling report',
+        params={'format': 'text (default): readable report. pstats: raw profile for pstats or snakeviz'},
+        responses={
+            200: 'Report file.',
+            403: 'Profiling disabled, or not an admin address.'
+        }
+    )
+    def get(self):
+        """
+        Download the results of the last profiling session: functions by cumulative time,
+        allocations by line if memory was traced, and the memory footprint of every License
+        """
+        with global_stack_context():
+
+            refused = refusal()
+            if refused:
+                return {'error_detail': refused}, 403
+            Log.debug(
+                '/admin/profiling/report received.',
+                topic=RECEIVED_REQUEST_GET
+            )
+
+            if request.args.get('format') == 'pstats':
+                return Response(
+                    profiler.dump(),
+                    mimetype='application/octet-stream',
+                    headers={'Content-Disposition': 'attachment; filename=license_manager.prof'}
+                )
+            return Response(
+                profiler.report(license_manager.licenses),
+                mimetype='text/plain',
+                headers={'Content-Disposition': 'attachment; filename=license_manager_profile.txt'}
+            )
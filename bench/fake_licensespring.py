@@ -0,0 +1,77 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import json
+import random
+import threading
+import time
+
+import requests
+
+from licensespring.api import ClientError
+
+from ..core.circuit_breaker import CircuitBreaker
+
+
+def client_error(message, status=400, code='license_not_found'):
+    '''
+    ClientError as the licensespring package raises it for an error answer from LicenseSpring
+    '''
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({'status': status, 'code': code, 'message': message}).encode()
+    return ClientError(response)
+
+
+class FakeLicenseSpring:
+    """
+    In-process stand-in for PooledAPIClient, for benchmarks. \n
+    Knows which product and features every key has, answers check_license / activate_license
+    like LicenseSpring would: ClientError for a key that isn't part of the product asked about.
+    Latency and failures (network errors) are drawn from a seeded random generator, so runs
+    with the same settings make the same calls fail
+    """
+    def __init__(self, licenses, latency=0.0, jitter=0.0, failure_rate=0.0, seed=1):
+        '''
+        :param licenses: dict of key:(product, [feature codes])
+        :param latency: seconds every call takes
+        :param jitter: up to this many seconds added at random
+        :param failure_rate: fraction of calls that fail with a connection error
+        '''
+        self.licenses = licenses
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        # same attributes the service reads off PooledAPIClient
+        self.breaker = CircuitBreaker()
+        self.calls = {'check_license': 0, 'activate_license': 0}
+        self.failures = 0
+
+    def answer(self, endpoint, product, license_key):
+        with self.random_lock:
+            self.calls[endpoint] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise requests.ConnectionError(f'fake LicenseSpring unreachable ({endpoint})')
+        owned = self.licenses.get(license_key)
+        if owned is None or owned[0] != product:
+            raise client_error(f'License {license_key} not found for product {product}')
+        return owned
+
+    def check_license(self, product, license_key, **kwargs):
+        _, codes = self.answer('check_license', product, license_key)
+        return {
+            'license_active': True,
+            'license_enabled': True,
+            'product_features': [{'code': code} for code in codes]
+        }
+
+    def activate_license(self, product, license_key, **kwargs):
+        self.answer('activate_license', product, license_key)
+        return {'license_active': True}
@@ -0,0 +1,177 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+#
+# Local HTTP stand-in for LicenseSpring's check_license and activate_license endpoints, for load tests.
+# Point a PooledAPIClient at it with
+#     api_protocol='http', api_domain='127.0.0.1:<port>', verify_license_signature=False
+# Answers are not signed.
+#
+# Standalone:
+#     python -m services.license_manager.bench.licensespring_server --port 8990 --keys 50 --latency 0.05
+#
+import argparse
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+API_PREFIX = '/api/v4'
+
+# how the stand-in misbehaves while an outage is on
+OUTAGE_503 = '503'          # answers 503 Service Unavailable
+OUTAGE_RESET = 'reset'      # closes the connection without answering
+OUTAGE_HANG = 'hang'        # answers only after the hang time, past any sane read timeout
+
+
+class LicenseSpringStandIn(ThreadingHTTPServer):
+    """
+    Answers check_license / activate_license from a fixed key:(product, features) table. \n
+    Every answer is delayed by latency plus up to jitter seconds. start_outage() / stop_outage()
+    switch the whole server to failing, as LicenseSpring going away would
+    """
+    daemon_threads = True
+
+    def __init__(self, licenses, port=0, latency=0.0, jitter=0.0, outage_mode=OUTAGE_503, hang=60, seed=1):
+        '''
+        :param licenses: dict of key:(product, [feature codes]), see synthetic.synthetic_licenses()
+        :param port: 0 picks a free port, see self.port
+        '''
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.licenses = licenses
+        self.latency = latency
+        self.jitter = jitter
+        self.outage_mode = outage_mode
+        self.hang = hang
+        self.outage = False
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {'check_license': 0, 'activate_license': 0, 'failed': 0}
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def api_domain(self):
+        return f'127.0.0.1:{self.port}'
+
+    def start(self):
+        '''
+        Serve on a background thread
+        :return: self
+        '''
+        self.thread = threading.Thread(target=self.serve_forever, name='licensespring_stand_in', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def start_outage(self, mode=None):
+        if mode is not None:
+            self.outage_mode = mode
+        self.outage = True
+
+    def stop_outage(self):
+        self.outage = False
+
+    def delay(self):
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] += 1
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # one line per request would drown the load report
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != API_PREFIX + '/check_license':
+            return self.answer(404, {'status': 404, 'code': 'not_found', 'message': 'Not found'})
+        query = parse_qs(url.query)
+        self.license_call('check_license', query.get('product', [''])[0], query.get('license_key', [''])[0])
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if url.path != API_PREFIX + '/activate_license':
+            return self.answer(404, {'status': 404, 'code': 'not_found', 'message': 'Not found'})
+        self.license_call('activate_license', body.get('product', ''), body.get('license_key', ''))
+
+    def license_call(self, endpoint, product, license_key):
+        server = self.server
+        server.count(endpoint)
+        time.sleep(server.delay())
+
+        if server.outage:
+            server.count('failed')
+            if server.outage_mode == OUTAGE_RESET:
+                self.close_connection = True
+                return
+            if server.outage_mode == OUTAGE_HANG:
+                time.sleep(server.hang)
+            return self.answer(503, {'status': 503, 'code': 'unavailable', 'message': 'Service unavailable'})
+
+        owned = server.licenses.get(license_key)
+        if owned is None or owned[0] != product:
+            return self.answer(400, {
+                'status': 400,
+                'code': 'license_not_found',
+                'message': f'License {license_key} not found for product {product}'
+            })
+        if endpoint == 'activate_license':
+            return self.answer(200, {'license_key': license_key, 'license_active': True})
+        return self.answer(200, {
+            'license_key': license_key,
+            'license_active': True,
+            'license_enabled': True,
+            'product_features': [{'code': code} for code in owned[1]]
+        })
+
+    def answer(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    from .synthetic import synthetic_catalog, synthetic_licenses
+
+    parser = argparse.ArgumentParser(description='Local LicenseSpring stand-in')
+    parser.add_argument('--port', type=int, default=8990)
+    parser.add_argument('--products', type=int, default=4)
+    parser.add_argument('--features', type=int, default=20)
+    parser.add_argument('--behaviors', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=50)
+    parser.add_argument('--features-per-key', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog(args.products, args.features, args.behaviors)
+    licenses = synthetic_licenses(catalog, args.keys, args.features_per_key, seed=args.seed)
+    server = LicenseSpringStandIn(licenses, args.port, args.latency, args.jitter, seed=args.seed)
+    print(f'LicenseSpring stand-in on http://{server.api_domain}{API_PREFIX}')
+    for license_key, (product, codes) in licenses.items():
+        print(f'{license_key}  {product}  {", ".join(codes)}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
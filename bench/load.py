@@ -0,0 +1,280 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+#
+# End-to-end load test: the full Flask/restx app from main.py, served by a 15 thread WSGI server like
+# soa_license_manager.conf, talking to the LicenseSpring stand-in over real HTTP. Client threads drive
+# a mix of reads and commands and the report gives throughput, p50/p99 latency and error rates.
+# Run from the soa directory, with SOA_DIR_LOCATION set as for the service:
+#
+#     python -m services.license_manager.bench.load --clients 30 --duration 60 --latency 0.05 \
+#         --outage-at 20 --outage-for 15 > bench_output.txt
+#
+# Persistent config is kept in memory for the run, the QuikStation's registered keys are never touched.
+# Licensing is started without custom_enable(): no entitlement broadcasts, shared state file or local socket,
+# so the service running on the unit is left alone.
+#
+import argparse
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from .micro import MemoryConfig, install, percentile
+from .synthetic import synthetic_catalog, synthetic_licenses
+from .licensespring_server import LicenseSpringStandIn, OUTAGE_503, OUTAGE_RESET, OUTAGE_HANG
+from ..core.transport import PooledAPIClient
+from ..core.license_check import license_manager
+from ..core.metrics import metrics
+from ..core.refresh import refresh_scheduler
+from ..main import app
+
+# operation: weight, per traffic mix
+MIXES = {
+    'read': {
+        'behavior': 70,
+        'check_behaviors': 10,
+        'licensed_features': 10,
+        'active_licenses': 5,
+        'view_license_keys': 5,
+    },
+    'mixed': {
+        'behavior': 60,
+        'check_behaviors': 10,
+        'licensed_features': 10,
+        'active_licenses': 5,
+        'view_license_keys': 5,
+        'add_license_key': 4,
+        'remove_license': 4,
+        'update_licenses': 2,
+    },
+    # read, with behavior checks through the fast path
+    'fast': {
+        'fast_behavior': 70,
+        'check_behaviors': 10,
+        'licensed_features': 10,
+        'active_licenses': 5,
+        'view_license_keys': 5,
+    },
+}
+
+BATCH_SIZE = 10
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        # an access log line per request would drown the report
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI server handling requests on a fixed number of threads, as mod_wsgi's threads=15 does
+    """
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class LoadClient:
+    """
+    One simulated consumer. Picks operations by weight and records how each one went
+    """
+    def __init__(self, base_url, mix, behaviors, registered, spare, spare_lock, seed):
+        self.base_url = base_url
+        self.mix = mix
+        self.behaviors = behaviors
+        self.registered = registered
+        self.spare = spare
+        self.spare_lock = spare_lock
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        self.etag = None
+        # maps "operation": list of (seconds, status), status 0 for a failed request
+        self.samples = {}
+
+    def run(self, until):
+        names = [*self.mix]
+        weights = [self.mix[name] for name in names]
+        while time.monotonic() < until:
+            name = self.random.choices(names, weights)[0]
+            started = time.monotonic()
+            try:
+                status = getattr(self, name)()
+            except requests.RequestException:
+                status = 0
+            self.samples.setdefault(name, []).append((time.monotonic() - started, status))
+
+    def behavior(self):
+        return self.session.get(f'{self.base_url}/licenseinfo/{self.random.choice(self.behaviors)}').status_code
+
+    def fast_behavior(self):
+        return self.session.get(f'{self.base_url}/licenseinfo/fast/{self.random.choice(self.behaviors)}').status_code
+
+    def check_behaviors(self):
+        batch = self.random.sample(self.behaviors, min(BATCH_SIZE, len(self.behaviors)))
+        return self.session.post(f'{self.base_url}/licenseinfo/check_behaviors', json={'behaviors': batch}).status_code
+
+    def licensed_features(self):
+        # half the pollers revalidate with the ETag they last saw
+        headers = {'If-None-Match': self.etag} if self.etag and self.random.random() < 0.5 else {}
+        response = self.session.get(f'{self.base_url}/licenseinfo/licensed_features', headers=headers)
+        self.etag = response.headers.get('ETag') or self.etag
+        return response.status_code
+
+    def active_licenses(self):
+        return self.session.get(f'{self.base_url}/licenseinfo/active_licenses').status_code
+
+    def view_license_keys(self):
+        return self.session.get(f'{self.base_url}/licenseinfo/view_license_keys').status_code
+
+    def add_license_key(self):
+        with self.spare_lock:
+            if not self.spare:
+                return self.view_license_keys()
+            license_key = self.spare.pop()
+        status = self.session.post(f'{self.base_url}/commands/add_license_key', json={'license_key': license_key}).status_code
+        with self.spare_lock:
+            (self.registered if status == 200 else self.spare).append(license_key)
+        return status
+
+    def remove_license(self):
+        with self.spare_lock:
+            if not self.registered:
+                return self.view_license_keys()
+            license_key = self.registered.pop(self.random.randrange(len(self.registered)))
+        status = self.session.post(f'{self.base_url}/commands/remove_license', json={'license_key': license_key}).status_code
+        with self.spare_lock:
+            (self.spare if status == 200 else self.registered).append(license_key)
+        return status
+
+    def update_licenses(self):
+        return self.session.post(f'{self.base_url}/commands/update_licenses', json={}).status_code
+
+
+def schedule_outage(stand_in, at, duration, mode):
+    def outage():
+        time.sleep(at)
+        print(f'-- outage ({mode}) from {at}s for {duration}s')
+        stand_in.start_outage(mode)
+        time.sleep(duration)
+        stand_in.stop_outage()
+    threading.Thread(target=outage, name='outage', daemon=True).start()
+
+
+def report(clients, elapsed, stand_in):
+    samples = {}
+    for client in clients:
+        for name, entries in client.samples.items():
+            samples.setdefault(name, []).extend(entries)
+    total = sum(len(entries) for entries in samples.values())
+    errors = sum(1 for entries in samples.values() for _, status in entries if status == 0 or status >= 500)
+
+    print(f'requests: {total}   throughput: {total / elapsed:.1f} req/s   errors: {errors} ({100 * errors / max(total, 1):.2f}%)')
+    print(f'{"operation":20} {"count":>7} {"err %":>7} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9}  statuses')
+    for name, entries in sorted(samples.items()):
+        seconds = sorted(s for s, _ in entries)
+        failed = sum(1 for _, status in entries if status == 0 or status >= 500)
+        statuses = {}
+        for _, status in entries:
+            statuses[status] = statuses.get(status, 0) + 1
+        print(
+            f'{name:20} {len(entries):>7} {100 * failed / len(entries):>7.2f} '
+            f'{1000 * percentile(seconds, 0.50):>9.1f} {1000 * percentile(seconds, 0.99):>9.1f} '
+            f'{1000 * seconds[-1]:>9.1f}  {dict(sorted(statuses.items()))}'
+        )
+    print(f'LicenseSpring stand-in requests: {stand_in.requests}')
+    print(f'LicenseSpring status: {license_manager.licensespring_status()}')
+    snapshot = metrics.snapshot()
+    for name, value in [*snapshot['counters'].items(), *snapshot['histograms'].items()]:
+        if name.startswith('licensespring.'):
+            print(f'{name}: {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='License Manager end-to-end load test')
+    parser.add_argument('--clients', type=int, default=30, help='concurrent consumer threads')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--mix', default='mixed', choices=[*MIXES])
+    parser.add_argument('--threads', type=int, default=15, help='WSGI server threads')
+    parser.add_argument('--port', type=int, default=0, help='port for the app, 0 picks a free one')
+    parser.add_argument('--products', type=int, default=4)
+    parser.add_argument('--features', type=int, default=20)
+    parser.add_argument('--behaviors', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=20, help='keys registered at the start')
+    parser.add_argument('--spare-keys', type=int, default=20, help='keys known to the stand-in, for add/remove')
+    parser.add_argument('--features-per-key', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per LicenseSpring call')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--outage-at', type=float, default=None, help='seconds into the run LicenseSpring goes away')
+    parser.add_argument('--outage-for', type=float, default=10)
+    parser.add_argument('--outage-mode', default=OUTAGE_503, choices=[OUTAGE_503, OUTAGE_RESET, OUTAGE_HANG])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog(args.products, args.features, args.behaviors)
+    licenses = synthetic_licenses(catalog, args.keys + args.spare_keys, args.features_per_key, seed=args.seed)
+    stand_in = LicenseSpringStandIn(licenses, latency=args.latency, jitter=args.jitter, seed=args.seed).start()
+
+    client = PooledAPIClient(
+        api_key='load-test',
+        shared_key='load-test',
+        api_protocol='http',
+        api_domain=stand_in.api_domain,
+        verify_license_signature=False,
+        pool_size=args.threads
+    )
+    config = MemoryConfig()
+    install(catalog, client, config)
+    license_keys = [*licenses]
+    config.values = {'license_keys': license_keys[:args.keys]}
+
+    started = time.monotonic()
+    license_manager.setup()
+    refresh_scheduler.start()
+    print(f'enabled with {args.keys} keys in {time.monotonic() - started:.2f}s')
+
+    server = PooledWSGIServer('127.0.0.1', args.port, app, args.threads)
+    threading.Thread(target=server.serve_forever, name='wsgi_server', daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.port}'
+
+    if args.outage_at is not None:
+        schedule_outage(stand_in, args.outage_at, args.outage_for, args.outage_mode)
+
+    behaviors = sorted(catalog.behaviors)
+    registered = license_keys[:args.keys]
+    spare = license_keys[args.keys:]
+    spare_lock = threading.Lock()
+    clients = [
+        LoadClient(base_url, MIXES[args.mix], behaviors, registered, spare, spare_lock, args.seed + n)
+        for n in range(args.clients)
+    ]
+    started = time.monotonic()
+    until = started + args.duration
+    threads = [threading.Thread(target=c.run, args=(until,), name=f'load_client_{n}') for n, c in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    report(clients, time.monotonic() - started, stand_in)
+    server.shutdown()
+    stand_in.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+#
+# Microbenchmarks for core/license_check.py, against FakeLicenseSpring and synthetic catalogs.
+# Run from the soa directory, with SOA_DIR_LOCATION set as for the service:
+#
+#     python -m services.license_manager.bench.micro --sizes small,medium,large > bench_output.txt
+#
+# Reports latency percentiles (microseconds) and memory allocated per operation (tracemalloc peak, bytes).
+# Persistent config is kept in memory for the run, the QuikStation's registered keys are never touched.
+#
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+
+soa_dir = os.environ.get('SOA_DIR_LOCATION', '_no_location_')
+if soa_dir == '_no_location_':
+    print('ERROR:  OT SOA services require the SOA_DIR_LOCATION environment variable to be set.')
+    exit()
+if os.path.abspath(soa_dir) not in sys.path:
+    sys.path.append(os.path.abspath(soa_dir))
+
+from ..core import license_check
+from ..core.license_check import license_manager, License, LicenseState, DEFAULT_REFRESH_WORKERS
+from .fake_licensespring import FakeLicenseSpring
+from .synthetic import synthetic_catalog, synthetic_licenses
+
+# products, features per product, behaviors per feature, registered keys, features per key
+SIZES = {
+    'small': (2, 5, 5, 4, 3),
+    'medium': (10, 40, 8, 50, 10),
+    'large': (40, 200, 16, 500, 40),
+}
+
+BATCH_SIZE = 20
+
+
+class MemoryConfig:
+    """
+    Stands in for the persistent config file during a run
+    """
+    def __init__(self):
+        self.values = {}
+
+    def read(self, name):
+        return self.values.get(name)
+
+    def write(self, name, value):
+        self.values[name] = value
+
+    def remove(self, name):
+        self.values.pop(name, None)
+
+
+def install(catalog, client, config):
+    '''
+    Point the importable license_manager at a synthetic catalog, a fake client and in-memory config
+    '''
+    license_manager.use_catalog(catalog)
+    license_manager.api_client = client
+    license_manager.current_state = LicenseState({}, frozenset(), 0, 0)
+    license_check.read_persistent_config = config.read
+    license_check.write_persistent_config = config.write
+    license_check.remove_persistent_config = config.remove
+    license_manager.setup_client()
+
+
+def wait_for_revalidation():
+    for thread in threading.enumerate():
+        if thread.name == 'license_revalidate':
+            thread.join()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(fn, iterations, prepare=None):
+    '''
+    :param fn: operation, called once per iteration
+    :param prepare: called untimed before each iteration
+    :return: dict of latency percentiles in microseconds and allocated bytes per call
+    '''
+    timings = []
+    for _ in range(iterations):
+        if prepare is not None:
+            prepare()
+        started = time.perf_counter_ns()
+        fn()
+        timings.append(time.perf_counter_ns() - started)
+    timings.sort()
+
+    # allocations in a separate pass, tracemalloc slows every allocation down
+    samples = min(iterations, 100)
+    allocated = 0
+    tracemalloc.start()
+    for _ in range(samples):
+        if prepare is not None:
+            prepare()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        'n': iterations,
+        'p50': percentile(timings, 0.50) / 1000,
+        'p90': percentile(timings, 0.90) / 1000,
+        'p99': percentile(timings, 0.99) / 1000,
+        'max': timings[-1] / 1000,
+        'alloc': allocated // samples,
+    }
+
+
+def run_size(size, args):
+    products, features, behaviors, keys, features_per_key = SIZES[size]
+    catalog = synthetic_catalog(products, features, behaviors)
+    licenses = synthetic_licenses(catalog, keys, features_per_key, seed=args.seed)
+    client = FakeLicenseSpring(
+        licenses,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    )
+    config = MemoryConfig()
+    install(catalog, client, config)
+    license_keys = [*licenses]
+    results = {}
+
+    # enablement, cold: nothing persisted but the keys, every key probed against LicenseSpring
+    def cold_start():
+        config.values = {'license_keys': license_keys}
+        license_manager.current_state = LicenseState({}, frozenset(), 0, 0)
+    results['setup (cold)'] = measure(license_manager.setup, args.setup_iterations, prepare=cold_start)
+
+    # enablement, warm: licenses rebuilt from the snapshot, revalidation left to the background thread
+    snapshot = dict(config.values)
+    def warm_start():
+        wait_for_revalidation()
+        config.values = dict(snapshot)
+        license_manager.current_state = LicenseState({}, frozenset(), 0, 0)
+    results['setup (warm)'] = measure(license_manager.setup, args.setup_iterations, prepare=warm_start)
+    wait_for_revalidation()
+
+    licensed = sorted(license_manager.licensed_behaviors)
+    unlicensed = sorted(catalog.behaviors - license_manager.licensed_behaviors)
+    batch = (licensed[:BATCH_SIZE // 2] + unlicensed[:BATCH_SIZE // 2])[:BATCH_SIZE]
+
+    results['check_behavior (licensed)'] = measure(
+        lambda: license_manager.check_behavior(licensed[0]), args.iterations)
+    if unlicensed:
+        results['check_behavior (unlicensed)'] = measure(
+            lambda: license_manager.check_behavior(unlicensed[0]), args.iterations)
+    results[f'check_behaviors ({len(batch)})'] = measure(
+        lambda: license_manager.check_behaviors(batch), args.iterations)
+    results['get_licensed_behaviors'] = measure(license_manager.get_licensed_behaviors, args.iterations)
+    results['get_active_licenses'] = measure(license_manager.get_active_licenses, args.iterations)
+
+    # set_features on a License of its own, so published state is left alone
+    license_key = license_keys[0]
+    product = licenses[license_key][0]
+    license_obj = License(license_key, resolve=False, product=product, activated=True)
+    same = client.check_license(product, license_key)
+    fewer = {'product_features': same['product_features'][1:]}
+    results['set_features (unchanged)'] = measure(lambda: license_obj.set_features(same), args.iterations)
+    answers = [same, fewer]
+    def alternate():
+        answers.reverse()
+    results['set_features (changed)'] = measure(
+        lambda: license_obj.set_features(answers[0]), args.iterations, prepare=alternate)
+
+    with ThreadPoolExecutor(max_workers=DEFAULT_REFRESH_WORKERS, thread_name_prefix='bench_refresh') as pool:
+        results['refresh_licenses (all)'] = measure(
+            lambda: license_manager.refresh_licenses(license_keys, pool), args.setup_iterations)
+
+    return {
+        'catalog': f'{products} products x {features} features x {behaviors} behaviors, '
+                   f'{keys} keys x {features_per_key} features',
+        'calls': dict(client.calls),
+        'results': results
+    }
+
+
+def report(size, run):
+    print(f'== {size}: {run["catalog"]}')
+    print(f'{"operation":32} {"n":>6} {"p50 us":>10} {"p90 us":>10} {"p99 us":>10} {"max us":>10} {"alloc B":>10}')
+    for name, r in run['results'].items():
+        print(
+            f'{name:32} {r["n"]:>6} {r["p50"]:>10.1f} {r["p90"]:>10.1f} {r["p99"]:>10.1f} '
+            f'{r["max"]:>10.1f} {r["alloc"]:>10}'
+        )
+    print(f'fake LicenseSpring calls: {run["calls"]}')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='License Manager core microbenchmarks')
+    parser.add_argument('--sizes', default='small,medium,large', help=f'comma separated, from {", ".join(SIZES)}')
+    parser.add_argument('--iterations', type=int, default=2000, help='calls per fast operation')
+    parser.add_argument('--setup-iterations', type=int, default=5, help='calls per setup/refresh operation')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per fake LicenseSpring call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds added per call')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of calls that fail to connect')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for size in args.sizes.split(','):
+        report(size, run_size(size, args))
+
+
+if __name__ == '__main__':
+    main()
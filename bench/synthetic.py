@@ -0,0 +1,46 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import random
+
+from ..core.catalog import Catalog
+
+
+def synthetic_catalog(products, features_per_product, behaviors_per_feature):
+    '''
+    Catalog shaped like soa.yaml, with generated names. Behaviors are shared between neighbouring
+    features, as real ones are, so the behavior index has overlaps to merge
+    :return: Catalog
+    '''
+    product_defs = {}
+    feature_descripts = {}
+    behavior_descripts = {}
+    for p in range(products):
+        features = {}
+        for f in range(features_per_product):
+            feature = f'feat_{p}_{f}'
+            behavs = [f'behav_{p}_{f + b}' for b in range(behaviors_per_feature)]
+            features[feature] = behavs
+            feature_descripts[feature] = f'Synthetic feature {f} of product {p}'
+            for behav in behavs:
+                behavior_descripts[behav] = f'Synthetic behavior {behav}'
+        product_defs[f'prod{p}'] = features
+    return Catalog(product_defs, feature_descripts, behavior_descripts)
+
+
+def synthetic_key(n):
+    digits = f'{n:016X}'
+    return '-'.join(digits[i:i + 4] for i in range(0, 16, 4))
+
+
+def synthetic_licenses(catalog, keys, features_per_key, seed=1):
+    '''
+    Keys spread over the catalog's products, each with a random pick of that product's features
+    :return: dict of key:(product, [feature codes]), as FakeLicenseSpring takes it
+    '''
+    rng = random.Random(seed)
+    products = sorted(catalog.products)
+    licenses = {}
+    for n in range(keys):
+        product = products[n % len(products)]
+        features = list(catalog.products[product])
+        licenses[synthetic_key(n + 1)] = (product, rng.sample(features, min(features_per_key, len(features))))
+    return licenses
@@ -0,0 +1,297 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+#
+# Client for other SOA services that check behaviors with the License Manager.
+#
+#     from services.license_manager.client import license_client
+#     if license_client.check('iscsi_targ'):
+#         ...
+#
+# Answers are cached in the calling process. Once an answer is older than the TTL, one conditional
+# GET /licenseinfo/licensed_features revalidates every cached answer at once: a 304 means license
+# state hasn't changed. Forward the entitlements_changed broadcast event to handle_event() and
+# cached answers are updated as soon as licenses change, without waiting for the TTL.
+#
+# Services on the same QuikStation can check through the License Manager's Unix domain socket instead,
+# skipping Apache and HTTP. Those checks aren't cached, every one is answered from current license state:
+#
+#     from services.license_manager.client import local_license_client
+#     if local_license_client.check('iscsi_targ'):
+#         ...
+#
+# Both clients raise
+#     NotFoundException             the behavior isn't defined in soa.yaml, from core/exceptions.py like the service's own
+#     LicenseServiceUnavailable     no answer from the License Manager: not reachable, not enabled (418), the socket was closed
+#                                   mid request, or the License Manager couldn't reach LicenseSpring (502).
+#                                   A plain Exception, so callers' "except Exception" handlers catch it
+#
+import json
+import socket
+import struct
+import threading
+import time
+
+import requests
+
+from .core.exceptions import NotFoundException
+
+DEFAULT_BASE_URL = 'http://localhost:5007/licenseinfo'
+DEFAULT_TTL = 30                  # seconds an answer is used before it is revalidated
+DEFAULT_TIMEOUT = (1, 10)         # connect, read seconds
+DEFAULT_SOCKET_PATH = '/var/www/soa/license_manager/license_manager.sock'
+DEFAULT_SOCKET_TIMEOUT = 10       # seconds
+
+# frame header of the local socket protocol, body length and status. See apis/local_socket.py
+HEADER = struct.Struct('>IH')
+
+SERVICE_NAME = 'license_manager'
+ENTITLEMENTS_CHANGED = 'entitlements_changed'
+
+
+class LicenseServiceUnavailable(Exception):
+    """
+    The License Manager gave no answer: not reachable, not enabled (418), the connection was closed mid request,
+    or it could not reach LicenseSpring (502)
+    """
+    pass
+
+
+class LicenseClient:
+    """
+    Behavior checks against the License Manager, cached in process. \n
+    Thread safe, one instance is meant to be shared by the whole calling service
+    """
+    def __init__(self, base_url=DEFAULT_BASE_URL, ttl=DEFAULT_TTL, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        # maps "behavior": permitted, valid for the state the etag names
+        self.cache = {}
+        self.etag = None
+        # state version and boot id the cache is current for
+        self.version = None
+        self.boot_id = None
+        # monotonic time the cache was last known to be current
+        self.validated_at = 0
+
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def check(self, behavior):
+        '''
+        Check if behavior is permitted
+        :param behavior: String
+        :return: Boolean, raises NotFoundException for undefined behaviors, LicenseServiceUnavailable if no answer
+        '''
+        self.revalidate()
+        permitted = self.cache.get(behavior)
+        if permitted is not None:
+            return permitted
+
+        response = self.request('GET', f'/{behavior}')
+        if response.status_code == 404:
+            raise NotFoundException(response.json().get('error_detail'))
+        permitted = response.json()['response']
+        with self.lock:
+            self.cache[behavior] = permitted
+        return permitted
+
+    def check_many(self, behaviors):
+        '''
+        Check several behaviors, the ones not cached in one round trip
+        :param behaviors: List of behavior names
+        :return: Tuple of (dict of behavior:Boolean, dict of behavior:error detail for undefined or illegal names)
+        '''
+        self.revalidate()
+        results = {}
+        missing = []
+        for behavior in behaviors:
+            permitted = self.cache.get(behavior)
+            if permitted is None:
+                missing.append(behavior)
+            else:
+                results[behavior] = permitted
+        if not missing:
+            return results, {}
+
+        response = self.request('POST', '/check_behaviors', json={'behaviors': missing})
+        body = response.json()
+        with self.lock:
+            self.cache.update(body.get('results') or {})
+        results.update(body.get('results') or {})
+        return results, body.get('errors') or {}
+
+    def revalidate(self, force=False):
+        '''
+        Make sure cached answers are current, once they are older than the TTL.
+        A 304 keeps them, otherwise the cache restarts from the licensed behaviors in the response
+        :param force: revalidate even if the TTL hasn't run out
+        :return: nothing
+        '''
+        if not force and time.monotonic() - self.validated_at < self.ttl:
+            return
+        headers = {'If-None-Match': f'"{self.etag}"'} if self.etag else {}
+        response = self.request('GET', '/licensed_features', headers=headers)
+        with self.lock:
+            if response.status_code != 304:
+                self.cache = {}
+                features = response.json()
+                features = features.get('features', features) or {}
+                for feature in features.values():
+                    for behavior in (feature or {}).get('behaviors') or {}:
+                        self.cache[behavior] = True
+                self.etag = response.headers.get('ETag', '').strip('"') or None
+                if self.etag:
+                    # the ETag is "<boot id>-<state version>", events carry on from there
+                    boot_id, version = self.etag.rsplit('-', 1)
+                    self.boot_id, self.version = boot_id, int(version)
+            self.validated_at = time.monotonic()
+
+    def invalidate(self):
+        '''
+        Forget every cached answer
+        :return: nothing
+        '''
+        with self.lock:
+            self.cache = {}
+            self.etag = None
+            self.validated_at = 0
+
+    def subscribe(self, callback):
+        '''
+        Be told when licensed behaviors change. Needs events forwarded to handle_event()
+        :param callback: function(added, removed), lists of behavior names.
+                         Called with added=None, removed=None when changes were missed and everything may have changed
+        :return: nothing
+        '''
+        self.subscribers.append(callback)
+
+    def handle_event(self, service, event, data):
+        '''
+        Feed a broadcast event from the calling service's /broadcast-event handler. Others than
+        the License Manager's entitlements_changed are ignored
+        :return: Boolean, whether the event was used
+        '''
+        if service != SERVICE_NAME or event != ENTITLEMENTS_CHANGED:
+            return False
+
+        with self.lock:
+            # versions between previous_version and version were never broadcast, they left behaviors as
+            # they were. Only a cache older than the previous broadcast missed something
+            missed = (
+                data['boot_id'] != self.boot_id or
+                self.version is None or
+                data['previous_version'] > self.version
+            )
+            if data['boot_id'] == self.boot_id and self.version is not None and data['version'] <= self.version:
+                # stale or repeated
+                return True
+            self.boot_id = data['boot_id']
+            self.version = data['version']
+            if missed:
+                # can't tell what else changed in between, start over on the next check
+                self.cache = {}
+                self.etag = None
+                self.validated_at = 0
+            else:
+                for behavior in data['added']:
+                    self.cache[behavior] = True
+                for behavior in data['removed']:
+                    self.cache[behavior] = False
+                self.etag = f'{data["boot_id"]}-{data["version"]}'
+
+        for callback in self.subscribers:
+            if missed:
+                callback(None, None)
+            else:
+                callback(data['added'], data['removed'])
+        return True
+
+    def request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise LicenseServiceUnavailable(f'License Manager not reachable: {e}')
+        if response.status_code in (418, 500, 502):
+            raise LicenseServiceUnavailable(f'License Manager answered {response.status_code}')
+        return response
+
+
+class LocalSocketClient:
+    """
+    Behavior checks over the License Manager's Unix domain socket. \n
+    Thread safe, each thread keeps its own connection open between checks
+    """
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=DEFAULT_SOCKET_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def check(self, behavior):
+        '''
+        Check if behavior is permitted
+        :param behavior: String
+        :return: Boolean, raises NotFoundException for undefined behaviors, LicenseServiceUnavailable if no answer
+        '''
+        return self.request({'behavior': behavior})['response']
+
+    def check_many(self, behaviors):
+        '''
+        Check several behaviors in one round trip
+        :param behaviors: List of behavior names
+        :return: Tuple of (dict of behavior:Boolean, dict of behavior:error detail for undefined or illegal names)
+        '''
+        body = self.request({'behaviors': behaviors})
+        return body.get('results') or {}, body.get('errors') or {}
+
+    def request(self, message):
+        payload = json.dumps(message).encode()
+        try:
+            status, body = self.exchange(payload)
+        except OSError:
+            # the License Manager may have restarted since this connection was opened, try a new one once
+            self.close()
+            try:
+                status, body = self.exchange(payload)
+            except OSError as e:
+                self.close()
+                raise LicenseServiceUnavailable(f'License Manager socket not reachable: {e}')
+        body = json.loads(body)
+        if status == 404:
+            raise NotFoundException(body.get('error_detail'))
+        if status != 200:
+            raise LicenseServiceUnavailable(f'License Manager answered {status}: {body.get("error_detail")}')
+        return body
+
+    def exchange(self, payload):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.path)
+            self.local.connection = connection
+            self.local.reader = connection.makefile('rb')
+        connection.sendall(HEADER.pack(len(payload), 0) + payload)
+        header = self.local.reader.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionResetError('License Manager closed the connection')
+        length, status = HEADER.unpack(header)
+        body = self.local.reader.read(length)
+        if len(body) < length:
+            raise ConnectionResetError('License Manager closed the connection')
+        return status, body
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            self.local.reader.close()
+            connection.close()
+        self.local.connection = None
+
+
+#
+# Importable instances.  Import these wherever we need them in the calling service.
+#
+license_client = LicenseClient()
+local_license_client = LocalSocketClient()
@@ -0,0 +1,192 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import random
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import requests
+
+from licensespring.api import ClientError
+
+from .log import log as Log
+from .log_topics import INTERNALDATA
+from .metrics import metrics
+
+# defaults for the call_policies tunables in static_config.yaml, per operation
+DEFAULT_POLICIES = {
+    'check': {
+        'retries': 2,               # extra attempts after the first
+        'backoff': 0.2,             # seconds, doubled per retry, full jitter
+        'backoff_max': 2.0,         # seconds
+        'hedge_percentile': 95,     # send a duplicate once a call is slower than this percentile, 0 = off
+    },
+    'activate': {
+        # activation is a write, so it is retried but never hedged by default
+        'retries': 1,
+        'backoff': 0.5,
+        'backoff_max': 2.0,
+        'hedge_percentile': 0,
+    },
+}
+DEFAULT_RETRY_BUDGET_RATIO = 0.2   # retries + hedges allowed per first attempt
+DEFAULT_RETRY_BUDGET_MAX = 10      # retries + hedges that can be saved up
+
+# successful call latencies kept per operation for the hedge threshold, and how many are needed first
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+
+def is_retryable(e):
+    '''
+    Whether a failed LicenseSpring call is worth another attempt.
+    A ClientError is LicenseSpring answering (key not found, wrong product...), so it is final
+    :param e: Exception raised by the call
+    :return: Boolean
+    '''
+    if isinstance(e, ClientError):
+        return False
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.HTTPError))
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every call policy. Each first attempt deposits `ratio` tokens and
+    each retry or hedge spends one, so during an outage extra traffic is capped at `ratio`
+    of normal traffic instead of multiplying it
+    """
+    def __init__(self, ratio=DEFAULT_RETRY_BUDGET_RATIO, max_tokens=DEFAULT_RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        '''
+        Spend a token if there is one
+        :return: Boolean, whether the retry/hedge may go ahead
+        '''
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class CallPolicy:
+    """
+    Retries with exponential backoff and optional hedging for one LicenseSpring operation
+    """
+    def __init__(self, name, budget, hedge_pool, retries=0, backoff=0.2, backoff_max=2.0, hedge_percentile=0):
+        self.name = name
+        self.budget = budget
+        self.hedge_pool = hedge_pool
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def hedge_delay(self):
+        '''
+        How long to wait for an attempt before sending a duplicate
+        :return: seconds, or None if hedging is off or there aren't enough samples yet
+        '''
+        if not self.hedge_percentile or len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+    def call(self, fn, *args, **kwargs):
+        '''
+        Run fn under this policy
+        :return: whatever fn returns, raises the last exception if every attempt fails
+        '''
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return self.attempt(fn, *args, **kwargs)
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                if not self.budget.withdraw():
+                    metrics.incr('licensespring.retry_budget.exhausted')
+                    raise
+                attempt += 1
+                metrics.incr(f'licensespring.{self.name}.retries')
+                sleep = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+                Log.debug(
+                    'Retrying LicenseSpring call.'
+                    '   Operation: {}'
+                    '   Attempt: {}'
+                    '   Sleep: {:.3f}'
+                    '   Exception: {}',
+                    self.name,
+                    attempt,
+                    sleep,
+                    e,
+                    topic=INTERNALDATA
+                )
+                time.sleep(sleep)
+
+    def attempt(self, fn, *args, **kwargs):
+        '''
+        One attempt, hedged with a duplicate if it runs longer than the hedge delay
+        :return: result of the first copy to succeed
+        '''
+        delay = self.hedge_delay()
+        if delay is None:
+            return self.timed(fn, *args, **kwargs)
+
+        first = self.hedge_pool.submit(self.timed, fn, *args, **kwargs)
+        pending = {first}
+        done, _ = wait(pending, timeout=delay)
+        if not done and self.budget.withdraw():
+            metrics.incr(f'licensespring.{self.name}.hedges')
+            Log.debug(
+                'Hedging LicenseSpring call.'
+                '   Operation: {}'
+                '   After: {:.3f}',
+                self.name,
+                delay,
+                topic=INTERNALDATA
+            )
+            pending.add(self.hedge_pool.submit(self.timed, fn, *args, **kwargs))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def timed(self, fn, *args, **kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.latencies.append(time.monotonic() - started)
+        return result
+
+
+def build_policies(config, budget, hedge_pool):
+    '''
+    Build one CallPolicy per operation
+    :param config: call_policies dict from static_config.yaml, operations/settings missing there use defaults
+    :return: dict of operation:CallPolicy
+    '''
+    config = config or {}
+    policies = {}
+    for name, defaults in DEFAULT_POLICIES.items():
+        settings = dict(defaults)
+        settings.update(config.get(name) or {})
+        policies[name] = CallPolicy(name, budget, hedge_pool, **settings)
+    return policies
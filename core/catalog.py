@@ -0,0 +1,86 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+from types import MappingProxyType
+
+
+class Catalog:
+    """
+    Read-only view of the products, features and behaviors defined in soa.yaml. \n
+    Shared by every License, which only holds feature codes into it, and replaced as a whole when soa.yaml is reloaded.
+    Description-rich dicts for the APIs are built from here on request
+    """
+    __slots__ = ('products', 'feature_descripts', 'behavior_descripts', 'behaviors')
+
+    def __init__(self, products, feature_descripts, behavior_descripts):
+        '''
+        :param products: dict of product:{feature:[behaviors]}
+        :param feature_descripts: dict of feature:description
+        :param behavior_descripts: dict of behavior:description
+        '''
+        products = products or {}
+        self.products = MappingProxyType({
+            product: MappingProxyType({
+                feature: tuple(behavs) for feature, behavs in features.items()
+            })
+            for product, features in products.items()
+        })
+        self.feature_descripts = MappingProxyType(dict(feature_descripts or {}))
+        self.behavior_descripts = MappingProxyType(dict(behavior_descripts or {}))
+
+        # every behavior defined for any product and feature
+        self.behaviors = frozenset(
+            behav
+            for features in self.products.values()
+            for behavs in features.values()
+            for behav in behavs
+        )
+
+    def known_features(self, product, codes):
+        '''
+        Keep only feature codes the catalog defines for product
+        :return: frozenset of feature codes
+        '''
+        features = self.products.get(product, {})
+        return frozenset(code for code in codes if code in features and code in self.feature_descripts)
+
+    def ordered(self, product, codes):
+        '''
+        Feature codes in the order soa.yaml lists them for product
+        :return: List of feature codes
+        '''
+        return [feature for feature in self.products.get(product, {}) if feature in codes]
+
+    def behaviors_of(self, product, codes):
+        '''
+        Behaviors granted by the given features of product
+        :return: set of behaviors
+        '''
+        features = self.products.get(product, {})
+        behavs = set()
+        for code in codes:
+            behavs.update(features.get(code, ()))
+        return behavs
+
+    def feature_view(self, product, codes):
+        '''
+        Feature dict with descriptions, as returned by the APIs \n
+        {
+            "feature1": {
+                "description": "",
+                "behaviors": {
+                    "behavior1": {"description": ""}
+                }
+            }
+        }
+        :return: newly built dict, safe for the caller to change
+        '''
+        features = self.products.get(product, {})
+        return {
+            code: {
+                'description': self.feature_descripts[code],
+                'behaviors': {
+                    behav: {'description': self.behavior_descripts.get(behav)}
+                    for behav in features[code]
+                }
+            }
+            for code in self.ordered(product, codes)
+        }
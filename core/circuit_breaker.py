@@ -0,0 +1,134 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import threading
+import time
+
+from .exceptions import CircuitOpenException
+from .call_policy import is_retryable
+from .log import log as Log
+from .log_topics import INTERNALDATA
+from .metrics import metrics
+
+# defaults for tunables that can be overridden in static_config.yaml
+DEFAULT_BREAKER_FAILURE_THRESHOLD = 5   # consecutive unreachable calls before the breaker opens
+DEFAULT_BREAKER_RESET_TIMEOUT = 30      # seconds open before one trial call is let through
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# before_call's token for the half open trial call, other calls get the breaker's opening count
+TRIAL = 'trial'
+
+
+class CircuitBreaker:
+    """
+    Stops calling LicenseSpring while it is unreachable. \n
+    After failure_threshold consecutive network failures the breaker opens and every call fails
+    immediately with CircuitOpenException. Once reset_timeout has passed a single trial call is let
+    through (half open): success closes the breaker, failure opens it again. Only the trial call decides
+    that, calls started before the breaker last opened are ignored when they finish.
+    Only network errors count. LicenseSpring answering with an error means it is reachable
+    """
+    def __init__(self, failure_threshold=DEFAULT_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_running = False
+        # times the breaker opened, tells calls started before the last opening apart
+        self.openings = 0
+        self.lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        '''
+        Run fn through the breaker
+        :return: whatever fn returns, raises CircuitOpenException without calling fn while open
+        '''
+        token = self.before_call()
+        # anything that isn't a success or a LicenseSpring answer counts as unreachable, including this
+        # service's own exceptions (BaseException), so a trial call always ends the half open state
+        reachable = False
+        try:
+            result = fn(*args, **kwargs)
+            reachable = True
+            return result
+        except Exception as e:
+            reachable = not is_retryable(e)
+            raise
+        finally:
+            self.after_call(token, reachable)
+
+    def before_call(self):
+        '''
+        :return: token to pass to after_call, TRIAL for the half open trial call.
+                 Raises CircuitOpenException if the call may not go through
+        '''
+        with self.lock:
+            if self.state == CLOSED:
+                return self.openings
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return TRIAL
+        metrics.incr('licensespring.breaker.rejected')
+        raise CircuitOpenException('LicenseSpring circuit breaker is open')
+
+    def after_call(self, token, reachable):
+        '''
+        :param token: what before_call returned for this call
+        :param reachable: Boolean, whether LicenseSpring answered
+        :return: nothing
+        '''
+        with self.lock:
+            if token == TRIAL:
+                self.trial_running = False
+            elif token != self.openings or self.state != CLOSED:
+                # started before the breaker last opened, what it found out is older than the trial's
+                return
+            if reachable:
+                if self.state != CLOSED:
+                    Log.info('LicenseSpring reachable again, circuit breaker closed', topic=INTERNALDATA)
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    metrics.incr('licensespring.breaker.opened')
+                    Log.warning(
+                        'LicenseSpring unreachable, circuit breaker open.'
+                        '   Consecutive failures: {}',
+                        self.failures,
+                        topic=INTERNALDATA
+                    )
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.openings += 1
+
+    def probe_now(self):
+        '''
+        Skip what is left of the reset timeout, the next call is the trial call.
+        For when we hear that the network is back
+        :return: nothing
+        '''
+        with self.lock:
+            if self.state == OPEN:
+                self.opened_at -= self.reset_timeout
+
+    def status(self):
+        '''
+        Current breaker state, for operators
+        :return: dict
+        '''
+        with self.lock:
+            status = {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+            }
+            if self.state != CLOSED:
+                status['open_seconds'] = round(time.monotonic() - self.opened_at, 1)
+            return status
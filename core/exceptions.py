@@ -6,4 +6,7 @@ class NotFoundException(LicenseServiceException):
     pass
 
 class CouldNotReachLicenseSpringException(LicenseServiceException):
-    pass
\ No newline at end of file
+    pass
+
+class CircuitOpenException(CouldNotReachLicenseSpringException):
+    pass
@@ -5,20 +5,32 @@ import copy
 import licensespring
 import json
 import re
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from contextlib import contextmanager
 from pathlib import Path
+from types import MappingProxyType
 
 licensespring.app_version = "MyApp 1.2.0"
 
-from licensespring.api import APIClient
 from licensespring.api import ClientError
 
-from shared.ot_logging import SoaLogger as Log
 from shared.utils import global_stack_context
 
 from ..core.exceptions import NotFoundException
 from ..core.exceptions import CouldNotReachLicenseSpringException
+from .log import log as Log, Lazy
 from .log_topics import INTERNALDATA, ENABLEMENT
+from .catalog import Catalog
+from .metrics import metrics
+from .shared_state import SharedStateFile
+from .transport import PooledAPIClient
+from .transport import DEFAULT_HTTP_POOL_SIZE, DEFAULT_HTTP_CONNECT_TIMEOUT, DEFAULT_HTTP_READ_TIMEOUT
+from .call_policy import DEFAULT_RETRY_BUDGET_RATIO, DEFAULT_RETRY_BUDGET_MAX
+from .call_policy import is_retryable
+from .circuit_breaker import DEFAULT_BREAKER_FAILURE_THRESHOLD, DEFAULT_BREAKER_RESET_TIMEOUT
 
 from shared.global_config import read_global_static_config
 from shared.local_config import read_local_static_config
@@ -26,94 +38,250 @@ from shared.local_config import read_persistent_config
 from shared.local_config import write_persistent_config
 from shared.local_config import remove_persistent_config
 
+# defaults for tunables that can be overridden in static_config.yaml
+DEFAULT_PROBE_WORKERS = 8          # threads shared by all product probes
+DEFAULT_PROBE_DEADLINE = 30        # seconds allowed to resolve the product of one key
+DEFAULT_HYDRATE_CONCURRENCY = 4    # keys resolved at once during enablement
+DEFAULT_REFRESH_WORKERS = 4        # keys refreshed at once by the refresh scheduler
+DEFAULT_OUTAGE_GRACE = 7 * 24 * 60 * 60   # seconds a license keeps its last known state while LicenseSpring is unreachable
+
+# bump whenever the layout of the persisted license snapshot changes
+# v2: added 'activated'
+SNAPSHOT_VERSION = 2
+READABLE_SNAPSHOT_VERSIONS = (1, 2)
+
+# most behaviors one check_behaviors request may name, enforced by the REST model and the local socket
+MAX_BATCH_BEHAVIORS = 256
 
 # 2 class version (v2)
 
 class License:
     '''
     Class for one license key and its associated information
+    Only feature codes are held here, descriptions and behaviors come from the shared
+    catalog (license_manager.catalog) when an API asks for them
     '''
-    def __init__(self, key):
+    __slots__ = ('license_key', 'active', 'product', 'activated', 'feature_codes', 'fetched_at')
+
+    def __init__(self, key, resolve=True, product="", activated=False):
         self.license_key = key
         self.active = False
-        self.product=""
-        self.features={}
-        self.behaviors={}
+        # product and activated may be remembered from an earlier resolution, saves probing every product
+        self.product=product
+        self.activated = activated
+        self.feature_codes = frozenset()
+        # when features were last fetched from LicenseSpring (epoch seconds, 0 = never)
+        self.fetched_at = 0
+        if not resolve:
+            # placeholder for a key we could not resolve yet, update_info() will retry
+            return
         try:
             # active will get set here, may not know product yet on first activation
-            self.set_license_info()
-        except:
-            raise CouldNotReachLicenseSpringException
+            self.resolve()
+        except CouldNotReachLicenseSpringException:
+            # keep the detail of what went wrong
+            raise
+        except Exception as e:
+            raise CouldNotReachLicenseSpringException(e)
 
-    def set_license_info(self):
+    @classmethod
+    def from_snapshot(cls, entry):
         '''
-        Check LicenseSpring for key and set info if possible
-        If key is not active or found in LicenseSpring, values stay null
-        :return: Tuple of product string, features dict, behaviors dict
+        Rebuild a License from its persisted snapshot without calling LicenseSpring
+        :param entry: dict written by to_snapshot()
+        :return: License
         '''
-        Log.debug(
-            f'Setting license info.'
-            f'   License key: {self.license_key}',
-            topic=INTERNALDATA
+        license_obj = cls(
+            entry['license_key'],
+            resolve=False,
+            product=entry['product'],
+            # v1 snapshots didn't record activation, an active key must have been activated
+            activated=entry.get('activated', entry['active'])
         )
-        for product in license_manager.products:
-            # have to check all defined products for LicenseSpring API call to (maybe) not fail
+        license_obj.active = entry['active']
+        # features the catalog no longer defines are dropped, they can't map to behaviors anyway
+        license_obj.set_feature_codes(entry['features'])
+        license_obj.fetched_at = entry['fetched_at']
+        return license_obj
+
+    def to_snapshot(self):
+        '''
+        Resolved state of this license, in the form persisted for warm start
+        :return: dict
+        '''
+        return {
+            'license_key': self.license_key,
+            'product': self.product,
+            'activated': self.activated,
+            'active': self.active,
+            'features': sorted(self.feature_codes),
+            'fetched_at': self.fetched_at
+        }
+
+    def resolve(self):
+        '''
+        Find this key in LicenseSpring and set its info.
+        If the product is already known, this is a single check against that product. All products
+        are only probed when the product is unknown, or no longer recognizes the key
+        :return: nothing
+        '''
+        if self.product:
             try:
-                self.active = self.activate(product)
-                data = license_manager.api_client.check_license(
-                    product=product,
-                    license_key=self.license_key)
-                Log.debug(f'testing 123')
-                self.product = product
-                self.set_features(data)
-
-                # return product, feature_dict, behav_dict
-            except CouldNotReachLicenseSpringException as e:
-                Log.error(
-                    f'License creation failed.'
-                    f'   Exception: {e}',
+                self.check(self.product)
+                return
+            except ClientError as e:
+                Log.debug(
+                    'Known product no longer recognizes key, probing all products.'
+                    '   License key: {}'
+                    '   Product: {}'
+                    '   Exception: {}',
+                    self.license_key,
+                    self.product,
+                    e,
                     topic=INTERNALDATA
                 )
-                raise
-            except Exception as e:
-                Log.debug(f'unhandled exception: {e}')
-                pass
+                # stays inactive if no product claims the key
+                self.active = False
+                self.feature_codes = frozenset()
+        self.set_license_info()
+
+    def check(self, product):
+        '''
+        Check this key against its known product, activating it first if that never succeeded
+        :param product: product code the key belongs to
+        :return: nothing, raises whatever the LicenseSpring client raises
+        '''
+        if not self.activated:
+            self.activated = self.activate(product)
+        data = license_manager.api_client.check_license(
+            product=product,
+            license_key=self.license_key)
+        self.active = data["license_active"]
+        self.set_features(data)
 
-    def set_behavs(self, product, feature):
+    def set_license_info(self):
         '''
-        Build the behavior dict for a given license key
-        :return: dict of behavior + description
+        Check LicenseSpring for key and set info if possible
+        Every defined product is probed in parallel on the license manager's probe pool.
+        The first product that recognizes the key wins and the remaining probes are abandoned.
+        If key is not active or found in LicenseSpring, values stay null
+        :return: nothing
         '''
         Log.debug(
-            f'License set behaviors.'
-            f'   License: {self.license_key}',
-            topic=ENABLEMENT
+            'Setting license info.'
+            '   License key: {}',
+            self.license_key,
+            topic=INTERNALDATA
         )
-        behav_dict = {}
-        for behav in license_manager.products[product][feature]:
-            behav_dict[behav] = {
-                'description': license_manager.defined_behaviors[behav]
-            }
-        return behav_dict
+        # have to check all defined products for LicenseSpring API call to (maybe) not fail
+        found = threading.Event()
+        pending = {
+            license_manager.probe_pool.submit(self.probe, product, found)
+            for product in license_manager.products
+        }
+        deadline = time.monotonic() + license_manager.probe_deadline
+        unreachable = False
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    Log.error(
+                        'License creation timed out.'
+                        '   License key: {}',
+                        self.license_key,
+                        topic=INTERNALDATA
+                    )
+                    raise CouldNotReachLicenseSpringException(
+                        f'Timed out resolving product for {self.license_key}')
+
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except (CouldNotReachLicenseSpringException, Exception) as e:
+                        # network trouble or breaker open, not an answer about this key
+                        Log.debug('unhandled exception: {}', e)
+                        unreachable = True
+                        continue
+                    if result is not None:
+                        self.product, self.active, data = result
+                        self.activated = self.active
+                        self.set_features(data)
+                        return
+        finally:
+            found.set()
+            for future in pending:
+                future.cancel()
+
+        if unreachable:
+            # no product claimed the key, but at least one could not be asked
+            raise CouldNotReachLicenseSpringException(
+                f'Could not resolve product for {self.license_key}')
+
+    def probe(self, product, found):
+        '''
+        Activate and check this key against a single product. Runs on the probe pool
+        :param product: product code to try
+        :param found: Event set once another probe has claimed the key
+        :return: Tuple of (product, active, check_license data), or None if key does not belong to product
+        '''
+        if found.is_set():
+            return None
+        active = self.activate(product)
+        try:
+            data = license_manager.api_client.check_license(
+                product=product,
+                license_key=self.license_key)
+        except ClientError:
+            # LicenseSpring answered, key is not part of this product
+            return None
+        found.set()
+        return product, active, data
+
+    @property
+    def features(self):
+        '''
+        Feature dict with descriptions and behaviors, built from the catalog on every access
+        :return: dict of features + description
+        '''
+        return license_manager.catalog.feature_view(self.product, self.feature_codes)
+
+    @property
+    def fingerprint(self):
+        '''
+        What the license's entitlements were derived from. Equal fingerprints grant equal behaviors
+        :return: Tuple of (product, frozenset of feature codes)
+        '''
+        return self.product, self.feature_codes
 
     def set_features(self, data):
         '''
-        Build the feature dict for a given license key
-        :return: dict of features + description
+        Set the features for a given license key from a LicenseSpring check_license response
+        :return: nothing
+        '''
+        self.set_feature_codes([feature["code"] for feature in data["product_features"]])
+        self.fetched_at = time.time()
+
+    def set_feature_codes(self, codes):
+        '''
+        Set the features for a given license key
+        Codes the catalog doesn't define for this license's product are dropped
+        :param codes: List of feature codes on the license
+        :return: nothing
         '''
+        feature_codes = license_manager.catalog.known_features(self.product, codes)
+        if feature_codes == self.feature_codes:
+            # same features as last time, which is nearly always
+            return
         Log.debug(
-            f'License set features.'
-            f'   License: {self.license_key}',
+            'License set features.'
+            '   License: {}'
+            '   Features: {}',
+            self.license_key,
+            Lazy(lambda: sorted(feature_codes)),
             topic=ENABLEMENT
         )
-        feature_dict = {}
-        for feature in data["product_features"]:
-            feature_dict[feature["code"]] = {
-                'description': license_manager.feature_descripts[feature["code"]],
-                'behaviors': self.set_behavs(self.product, feature["code"])
-            }
-        self.features = copy.deepcopy(feature_dict)
-        Log.debug(f'testing features: {self.features}')
+        self.feature_codes = feature_codes
 
     def activate(self, product):
         '''
@@ -121,8 +289,9 @@ class License:
         :return: boolean
         '''
         Log.debug(
-            f'License activate'
-            f'   License: {self.license_key}',
+            'License activate'
+            '   License: {}',
+            self.license_key,
             topic=ENABLEMENT
         )
         try:
@@ -140,21 +309,96 @@ class License:
         :return: nothing, just update class members
         '''
         Log.debug(
-            f'Single License update info'
-            f'   License: {self.license_key}',
+            'Single License update info'
+            '   License: {}',
+            self.license_key,
             topic=INTERNALDATA
         )
+        if not self.product:
+            # never resolved (LicenseSpring was unreachable when key was loaded), start from scratch
+            self.set_license_info()
+            return
         try:
-            data = license_manager.api_client.check_license(
-                product=self.product,
-                license_key=self.license_key)
-            if data:
-                self.active = data["license_active"]
-                self.set_features(data)
-        except:
-            # License does not exist in LicenseSpring or is inactive
+            self.resolve()
+        except (CouldNotReachLicenseSpringException, Exception) as e:
+            if not isinstance(e, CouldNotReachLicenseSpringException) and not is_retryable(e):
+                # License does not exist in LicenseSpring or is inactive
+                self.active = False
+                return
+            # LicenseSpring unreachable says nothing about the license, keep serving what we last knew
+            stale = time.time() - self.fetched_at
+            if stale <= license_manager.outage_grace:
+                raise CouldNotReachLicenseSpringException(
+                    f'Keeping last known state of {self.license_key}: {e}')
+            Log.warning(
+                'LicenseSpring unreachable past grace window, deactivating license.'
+                '   License key: {}'
+                '   Seconds since last fetch: {:.0f}',
+                self.license_key,
+                stale,
+                topic=INTERNALDATA
+            )
             self.active = False
 
+    def changes_since(self, old):
+        '''
+        What changed between an earlier state of this license and now
+        :param old: License, earlier state of the same key
+        :return: dict of change details, or None if nothing a consumer would notice changed
+        '''
+        if self.fingerprint == old.fingerprint and self.active == old.active:
+            return None
+        features = self.feature_codes if self.active else frozenset()
+        old_features = old.feature_codes if old.active else frozenset()
+        return {
+            'activated': self.active and not old.active,
+            'deactivated': old.active and not self.active,
+            'features_added': sorted(features - old_features),
+            'features_removed': sorted(old_features - features)
+        }
+
+    def refreshed(self):
+        '''
+        Updated copy of this license. The live object is left alone, so the caller can
+        publish the copy once it is complete
+        :return: License
+        '''
+        fresh = copy.copy(self)
+        fresh.update_info()
+        return fresh
+
+
+def load_catalog():
+    '''
+    Catalog of the products, features and behaviors currently defined in soa.yaml
+    :return: Catalog
+    '''
+    return Catalog(
+        read_global_static_config('products'),
+        read_global_static_config('features'),
+        read_global_static_config('behaviors')
+    )
+
+
+class LicenseState:
+    '''
+    Immutable snapshot of everything readers need: the registered licenses, the behaviors they
+    grant, the state version and the version the behaviors last changed at. \n
+    Writers build a new LicenseState off to the side and publish it by swapping
+    LicenseManager.state, a single reference assignment. Readers take one reference to the
+    current state and get a consistent view without locking. The License objects inside a
+    published state are never changed afterwards (refreshes work on copies)
+    '''
+    __slots__ = ('licenses', 'licensed_behaviors', 'version', 'behaviors_version')
+
+    def __init__(self, licenses, licensed_behaviors, version, behaviors_version):
+        # maps "key": License() object, read-only
+        self.licenses = MappingProxyType(licenses)
+        self.licensed_behaviors = licensed_behaviors
+        self.version = version
+        # version of the last publish that changed licensed_behaviors, i.e. of the last entitlements event
+        self.behaviors_version = behaviors_version
+
 
 #
 # Class to interact with LicenseSpring
@@ -173,54 +417,485 @@ class LicenseManager:
         self.api_client = None
 
         # must match product code in licensespring!!!! (soa.yaml)
-        self.products = read_global_static_config('products')
+        # one read-only catalog shared by every License, replaced as a whole by reload_catalog()
+        self.use_catalog(load_catalog())
+        # bumped by reload_catalog(), shared processes rebuild theirs when it moves
+        self.catalog_version = 0
+
+        # current LicenseState, replaced as a whole by publish(), never changed in place
+        # state / licenses / licensed_behaviors / state_version below are read from it
+        self.current_state = LicenseState({}, frozenset(), 0, 0)
 
-        self.defined_behaviors = read_global_static_config('behaviors')
-        self.feature_descripts = read_global_static_config('features')
+        # SharedStateFile when several processes serve the API, see enable_shared_state()
+        self.shared = None
+        # generation of the shared file current_state was loaded from or written to
+        self.shared_generation = 0
 
-        # maps "key": License() object
-        self.licenses = {}
+        # seconds a license keeps serving its last known state while LicenseSpring is unreachable
+        self.outage_grace = DEFAULT_OUTAGE_GRACE
 
+        # product probing for new keys, sized in setup()
+        self.probe_pool = None
+        self.probe_deadline = DEFAULT_PROBE_DEADLINE
+
+        # maps "key": error detail for keys that could not be resolved during setup()
+        self.hydration_failures = {}
+        # cleared while a warm start's revalidation is resolving keys in the background
+        self.revalidated = threading.Event()
+        self.revalidated.set()
+
+        # serializes writers (commands, refreshes, revalidation) so none of them publishes over another's change
+        # readers never take it
+        self.write_lock = threading.RLock()
+
+        # state versions let the APIs cache responses, boot_id keeps versions from different runs apart
+        self.boot_id = uuid.uuid4().hex[:8]
+
+        # called with (added behaviors, removed behaviors, state version) whenever licensed behaviors change
+        self.listeners = []
+
+    @property
+    def state(self):
+        """
+        Current LicenseState. In shared state mode, reloaded first if another process published
+        """
+        if self.shared is not None and self.shared.generation() != self.shared_generation:
+            self.sync()
+        return self.current_state
+
+    @property
+    def licenses(self):
+        """
+        Registered licenses of the current state, read-only. maps "key": License() object
+        Take self.state once instead when several reads have to agree with each other
+        """
+        return self.state.licenses
+
+    @property
+    def licensed_behaviors(self):
+        """
+        Behaviors granted by the active licenses of the current state
+        """
+        return self.state.licensed_behaviors
+
+    @property
+    def state_version(self):
+        """
+        Bumped on every change to license state
+        """
+        return self.state.version
+
+    def use_catalog(self, catalog):
+        """
+        Make catalog the one licenses and behavior checks go by
+        :param catalog: Catalog
+        :return: nothing
+        """
+        self.catalog = catalog
+        self.products = catalog.products
+        self.defined_behaviors = catalog.behavior_descripts
+        self.feature_descripts = catalog.feature_descripts
+        # entitlement index, so behavior checks are a single set lookup
+        # every behavior defined in soa.yaml, across all products and features
+        self.catalog_behaviors = catalog.behaviors
+
+    def reload_catalog(self):
+        """
+        Rebuild the catalog from soa.yaml and republish, so licensed behaviors are recomputed against it.
+        The state version moves, and entitlements_changed goes out if the licensed behaviors did. \n
+        Features a license was resolved with before the catalog defined them show up on its next refresh
+        :return: the new LicenseState
+        """
+        with self.writing():
+            self.use_catalog(load_catalog())
+            self.catalog_version += 1
+            return self.publish(dict(self.current_state.licenses))
+
+    def enable_shared_state(self, path):
+        """
+        Share license state with the service's other processes through the file at path.
+        Must be called before setup(). Calling it again with the same path, e.g. on a re-enable,
+        keeps the file already open along with any ownership this process holds
+        :param path: file for the memory-mapped state, plus <path>.lock and <path>.owner
+        :return: SharedStateFile
+        """
+        if self.shared is not None:
+            if self.shared.path == path:
+                return self.shared
+            self.shared.close()
+        Log.info('License state shared through {}', path, topic=ENABLEMENT)
+        self.shared = SharedStateFile(path)
+        self.shared_generation = -1
+        return self.shared
+
+    def sync(self):
+        """
+        Reload current_state from the shared file if another process published since we last looked
+        :return: nothing
+        """
+        with self.shared.locked(shared=True):
+            generation, payload = self.shared.read()
+            if generation == self.shared_generation:
+                return
+            if payload:
+                data = json.loads(payload)
+                if data['catalog_version'] != self.catalog_version:
+                    # another process reloaded soa.yaml, licenses below are filtered through the catalog
+                    self.use_catalog(load_catalog())
+                    self.catalog_version = data['catalog_version']
+                licenses = {}
+                for entry in data['licenses']:
+                    licenses[entry['license_key']] = License.from_snapshot(entry)
+                self.boot_id = data['boot_id']
+                self.current_state = LicenseState(
+                    licenses,
+                    frozenset(data['licensed_behaviors']),
+                    data['version'],
+                    data['behaviors_version']
+                )
+            self.shared_generation = generation
+        metrics.incr('shared_state.reloads')
+        Log.debug(
+            'License manager loaded shared state.'
+            '   Generation: {}',
+            generation,
+            topic=INTERNALDATA
+        )
+
+    @contextmanager
+    def writing(self):
+        """
+        Hold while changing license state. Serializes writers in this process and, in shared
+        state mode, across processes, starting from the latest state any of them published
+        """
+        with self.write_lock:
+            if self.shared is None:
+                yield
+                return
+            with self.shared.locked():
+                if self.shared.generation() != self.shared_generation:
+                    self.sync()
+                yield
+
+    def setup_client(self):
+        '''
+        Set up the LicenseSpring client and the pools that use it.
+        Called on enablement in every process, api setup must come before license creation!!!
+        :return: nothing
+        '''
+        # set already when setup runs again after a takeover, or when a fake client was put in for benchmarks
+        if self.api_client is None:
+            api_key = read_local_static_config('api_key')
+            shared_key = read_local_static_config('shared_key')
+            # one keep-alive connection pool shared by every thread, see transport.py
+            self.api_client = PooledAPIClient(
+                api_key=api_key,
+                shared_key=shared_key,
+                pool_size=read_local_static_config('http_pool_size') or DEFAULT_HTTP_POOL_SIZE,
+                connect_timeout=read_local_static_config('http_connect_timeout') or DEFAULT_HTTP_CONNECT_TIMEOUT,
+                read_timeout=read_local_static_config('http_read_timeout') or DEFAULT_HTTP_READ_TIMEOUT,
+                call_policies=read_local_static_config('call_policies'),
+                retry_budget_ratio=read_local_static_config('retry_budget_ratio') or DEFAULT_RETRY_BUDGET_RATIO,
+                retry_budget_max=read_local_static_config('retry_budget_max') or DEFAULT_RETRY_BUDGET_MAX,
+                breaker_failure_threshold=read_local_static_config('breaker_failure_threshold') or DEFAULT_BREAKER_FAILURE_THRESHOLD,
+                breaker_reset_timeout=read_local_static_config('breaker_reset_timeout') or DEFAULT_BREAKER_RESET_TIMEOUT
+            )
+        self.outage_grace = read_local_static_config('outage_grace') or DEFAULT_OUTAGE_GRACE
+
+        # bounded pool so probes for many keys x products can't flood LicenseSpring
+        self.probe_deadline = read_local_static_config('probe_deadline') or DEFAULT_PROBE_DEADLINE
+        if self.probe_pool is None:
+            self.probe_pool = ThreadPoolExecutor(
+                max_workers=read_local_static_config('probe_workers') or DEFAULT_PROBE_WORKERS,
+                thread_name_prefix='license_probe'
+            )
 
     def setup(self):
         '''
         Do initializations.
-        Called on enablement
-        :return:
+        Called on enablement, in the process that owns refresh
+        :return: dict of key:error detail for keys that could not be resolved
         '''
         # read keys from persistent file
         license_keys = read_persistent_config('license_keys')
         Log.debug(
-            f"LicenseManager class Setup. "
-            f"Current registered keys are {license_keys}",
+            "LicenseManager class Setup. "
+            "Current registered keys are {}",
+            license_keys,
+            topic=ENABLEMENT
+        )
+        self.setup_client()
+
+        if license_keys is None:
+            license_keys = []
+
+        # warm start: serve the last resolved state right away, check it with LicenseSpring in the background
+        snapshot = self.load_snapshot(license_keys)
+        if snapshot is not None:
+
+            with self.writing():
+                self.publish(snapshot)
+            self.revalidated.clear()
+            threading.Thread(
+                target=self.revalidate,
+                args=(license_keys,),
+                name='license_revalidate',
+                daemon=True
+            ).start()
+            return {}
+
+        # cold start: nothing usable on disk, have to wait for LicenseSpring
+        hydrated, self.hydration_failures = self.hydrate(license_keys)
+        with self.writing():
+            self.publish(hydrated)
+            self.save_state()
+        return self.hydration_failures
+
+    def revalidate(self, license_keys):
+        """
+        Background half of a warm start. Re-resolves every key against LicenseSpring and
+        replaces the snapshot licenses with the results. \n
+        Keys that can't be reached keep serving their snapshot state, so the service works offline
+        :param license_keys: List of keys the snapshot was loaded for
+        :return: nothing
+        """
+        try:
+            snapshot = dict(self.licenses)
+            hydrated, self.hydration_failures = self.hydrate(license_keys, fallback=snapshot)
+            with self.writing():
+                licenses = dict(self.licenses)
+                # keys may have been removed, re-added or refreshed while we were talking to LicenseSpring,
+                # only replace the ones still holding their snapshot License
+                for license_key, license_obj in hydrated.items():
+                    if license_key in snapshot and licenses.get(license_key) is snapshot[license_key]:
+                        licenses[license_key] = license_obj
+                self.publish(licenses)
+                self.save_state()
+        finally:
+            self.revalidated.set()
+        Log.info(
+            'License revalidation finished.'
+            '   Keys: {}'
+            '   Failed: {}',
+            len(hydrated),
+            len(self.hydration_failures),
             topic=ENABLEMENT
         )
 
-        # api setup must come before license creation!!!
-        api_key = read_local_static_config('api_key')
-        shared_key = read_local_static_config('shared_key')
-        self.api_client = APIClient(
-            api_key=api_key,
-            shared_key=shared_key
+    def hydrate(self, license_keys, fallback=None):
+        """
+        Build a License for every key concurrently, at most hydrate_concurrency at a time. \n
+        A key that can't be resolved does not stop the others. It gets its fallback License if
+        there is one, otherwise an unresolved placeholder (inactive, product unknown) so it
+        stays on file and gets resolved by the next update
+        :param license_keys: List of keys
+        :param fallback: dict of key:License to use for keys that fail
+        :return: Tuple of (dict key:License in key order, dict key:error detail for every key that failed)
+        """
+        concurrency = read_local_static_config('hydrate_concurrency') or DEFAULT_HYDRATE_CONCURRENCY
+        Log.debug(
+            'License manager hydrate licenses.'
+            '   Keys: {}'
+            '   Concurrency: {}',
+            len(license_keys),
+            concurrency,
+            topic=ENABLEMENT
         )
+        if fallback is None:
+            fallback = {}
+        hydrated = {}
+        failures = {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='license_hydrate') as pool:
+            futures = {}
+            for license_key in license_keys:
+                known = fallback.get(license_key)
+                if known is not None:
+                    future = pool.submit(License, license_key, product=known.product, activated=known.activated)
+                else:
+                    future = pool.submit(License, license_key)
+                futures[future] = license_key
+            for future in as_completed(futures):
+                license_key = futures[future]
+                try:
+                    hydrated[license_key] = future.result()
+                except CouldNotReachLicenseSpringException as e:
+                    failures[license_key] = f'Could not reach LicenseSpring: {e}'
+                except Exception as e:
+                    failures[license_key] = f'Unexpected error: {e}'
+
+        for license_key, detail in failures.items():
+            Log.error(
+                'License hydration failed.'
+                '   License key: {}'
+                '   Detail: {}',
+                license_key,
+                detail,
+                topic=ENABLEMENT
+            )
+            hydrated[license_key] = fallback.get(license_key) or License(license_key, resolve=False)
+        metrics.observe('hydrate', time.monotonic() - started)
+        metrics.incr('hydrate.failed', len(failures))
+
+        # keep the order keys were registered in
+        return {license_key: hydrated[license_key] for license_key in license_keys}, failures
+
+    def load_snapshot(self, license_keys):
+        """
+        Read the persisted license snapshot written by save_state()
+        Keys registered but missing from the snapshot come back as unresolved placeholders
+        :param license_keys: List of registered keys
+        :return: dict key:License, or None if there is no usable snapshot
+        """
+        snapshot = read_persistent_config('license_snapshot')
+        if not snapshot or snapshot.get('version') not in READABLE_SNAPSHOT_VERSIONS:
+            Log.debug(
+                'No usable license snapshot, cold start.',
+                topic=ENABLEMENT
+            )
+            return None
 
-        if license_keys is not None:
+        try:
+            entries = {entry['license_key']: entry for entry in snapshot['licenses']}
+            licenses = {}
             for license_key in license_keys:
-                new_license = License(license_key)
-                self.licenses[license_key] = new_license
+                if license_key in entries:
+                    licenses[license_key] = License.from_snapshot(entries[license_key])
+                else:
+                    licenses[license_key] = License(license_key, resolve=False)
+        except Exception as e:
+            Log.warning(
+                'License snapshot unreadable, cold start.'
+                '   Exception: {}',
+                e,
+                topic=ENABLEMENT
+            )
+            return None
+        Log.debug(
+            'Loaded license snapshot.'
+            '   Keys: {}',
+            len(licenses),
+            topic=ENABLEMENT
+        )
+        return licenses
+
+    def save_state(self):
+        """
+        Persist registered keys and the resolved state of each license
+        :return: nothing
+        """
+        state = self.state
+        license_keys = [*state.licenses.keys()]
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'licenses': [license_obj.to_snapshot() for license_obj in state.licenses.values()]
+        }
+        # clear and rewrite config file of registered keys
+        remove_persistent_config('license_keys')
+        write_persistent_config('license_keys', license_keys)
+        remove_persistent_config('license_snapshot')
+        write_persistent_config('license_snapshot', snapshot)
+
+    def publish(self, licenses, changed=True):
+        """
+        Make licenses the current state. Caller must hold writing(). \n
+        Computes the behaviors the active licenses grant and swaps in a new LicenseState, so
+        readers never see a partial change.
+        :param licenses: dict of key:License, owned by the new state from here on
+        :param changed: False when no license's active flag or features changed (only fetched_at),
+                        then the behavior index and state version are carried over
+        :return: the new LicenseState
+        """
+        current = self.current_state
+        if not changed:
+            self.current_state = LicenseState(licenses, current.licensed_behaviors, current.version, current.behaviors_version)
+            self.share()
+            return self.current_state
+
+        licensed = set()
+        for license_obj in licenses.values():
+            if license_obj.active:
+                licensed.update(self.catalog.behaviors_of(license_obj.product, license_obj.feature_codes))
+        licensed = frozenset(licensed)
+        version = current.version + 1
+        behaviors_version = version if licensed != current.licensed_behaviors else current.behaviors_version
+        self.current_state = LicenseState(licenses, licensed, version, behaviors_version)
+        self.share()
+        self.notify(current, self.current_state)
+        Log.debug(
+            'License manager published license state.'
+            '   Licensed behaviors: {}'
+            '   State version: {}',
+            len(licensed),
+            self.current_state.version,
+            topic=INTERNALDATA
+        )
+        return self.current_state
+
+    def add_listener(self, listener):
+        """
+        Register for entitlement changes. Listeners are called with writing() held, they must not block
+        :param listener: function(added, removed, version, previous_version), added/removed are sorted lists of
+                         behavior names, previous_version is the version of the change before this one
+        :return: nothing
+        """
+        self.listeners.append(listener)
+
+    def notify(self, before, state):
+        """
+        Tell listeners which behaviors state grants or revokes compared to before
+        :param before: the previously published LicenseState
+        :param state: the newly published LicenseState
+        :return: nothing
+        """
+        added = sorted(state.licensed_behaviors - before.licensed_behaviors)
+        removed = sorted(before.licensed_behaviors - state.licensed_behaviors)
+        if not added and not removed:
+            return
+        for listener in self.listeners:
+            try:
+                listener(added, removed, state.version, before.behaviors_version)
+            except Exception as e:
+                Log.warning(
+                    'Entitlement listener failed.'
+                    '   Exception: {}',
+                    e,
+                    topic=INTERNALDATA
+                )
+
+    def share(self):
+        """
+        In shared state mode, write current_state for the other processes. Caller must hold writing()
+        :return: nothing
+        """
+        if self.shared is None:
+            return
+        state = self.current_state
+        payload = {
+            'boot_id': self.boot_id,
+            'catalog_version': self.catalog_version,
+            'version': state.version,
+            'behaviors_version': state.behaviors_version,
+            'licensed_behaviors': sorted(state.licensed_behaviors),
+            'licenses': [license_obj.to_snapshot() for license_obj in state.licenses.values()]
+        }
+        self.shared_generation = self.shared.write(json.dumps(payload).encode())
+        metrics.incr('shared_state.writes')
 
     def check_behavior(self, behav):
         """
         Determines whether requested behavior is permitted. \n
-        Checks for requested behavior in data structure returned from get_licensed_behaviors
+        Checks for requested behavior in the licensed behavior index
         Raises exceptions if behavior undefined
         :param behav:String
         :return: Boolean
         """
         Log.debug(
-            f'License manager check behavior'
-            f'   Behavior: {behav}',
-            topic=INTERNALDATA
+            'License manager check behavior'
+            '   Behavior: {}',
+            behav,
+            topic=INTERNALDATA,
+            sample=True
         )
         #
         # check for illegal characters
@@ -228,34 +903,72 @@ class LicenseManager:
         valid = self.validate_behav(behav)
         if not valid:
             Log.warning(
-                f'Behavior contains illegal characters'
+                'Behavior contains illegal characters'
             )
+            metrics.incr('check_behavior.illegal')
             raise NotFoundException('Behavior contains illegal characters')
 
         #
         # check if behavior is even defined (soa.yaml)
-        # data structure not in terms of behaviors, so have to search for it
         #
-        behav_found = False
-        for product in self.products:
-            for feature in self.products[product]:
-                if behav in self.products[product][feature]:
-                    behav_found = True
-        if not behav_found:
+        if behav not in self.catalog_behaviors:
             Log.warning(
-                f'Behavior {behav} does not exist'
+                'Behavior {} does not exist',
+                behav
             )
+            metrics.incr('check_behavior.undefined')
             raise NotFoundException(f'Behavior {behav} does not exist, check your spelling')
 
         # behavior is defined, so check if licensed for it
-        for license_obj in self.licenses.values():
-            if license_obj.active:
-                for feature in license_obj.features.values():
-                    if behav in [*feature['behaviors'].keys()]:
-                        return True
+        permitted = behav in self.state.licensed_behaviors
+        metrics.incr('check_behavior.granted' if permitted else 'check_behavior.denied')
+        return permitted
 
-        return False
 
+    def licensespring_status(self):
+        """
+        Health of the connection to LicenseSpring, for operators
+        :return: dict with circuit breaker state and outage grace window
+        """
+        status = {'outage_grace_seconds': self.outage_grace}
+        if self.api_client is not None:
+            status.update(self.api_client.breaker.status())
+        return status
+
+    def check_behaviors(self, behavs):
+        """
+        Batch version of check_behavior. \n
+        Every behavior is answered from the same licensed behavior index, so the results
+        are consistent with each other even if license state changes mid-request.
+        Undefined or illegal behaviors do not fail the batch, they are reported per name
+        :param behavs: List of behavior strings
+        :return: Tuple of (dict behavior:Boolean, dict behavior:error detail)
+        """
+        Log.debug(
+            'License manager check behaviors'
+            '   Behaviors: {}',
+            behavs,
+            topic=INTERNALDATA,
+            sample=True
+        )
+        # take one reference to the state, writers swap in a new one rather than changing this one
+        licensed = self.state.licensed_behaviors
+
+        results = {}
+        errors = {}
+        for behav in behavs:
+            if not self.validate_behav(behav):
+                errors[behav] = 'Behavior contains illegal characters'
+            elif behav not in self.catalog_behaviors:
+                errors[behav] = f'Behavior {behav} does not exist, check your spelling'
+            else:
+                results[behav] = behav in licensed
+        granted = sum(results.values())
+        metrics.incr('check_behaviors.batches')
+        metrics.incr('check_behavior.granted', granted)
+        metrics.incr('check_behavior.denied', len(results) - granted)
+        metrics.incr('check_behavior.undefined', len(errors))
+        return results, errors
 
     def validate_behav(self, behav):
         """
@@ -279,14 +992,15 @@ class LicenseManager:
         :return: Key that was added or error message
         """
         Log.debug(
-            f'License manager add license key'
-            f'   License key: {key}',
+            'License manager add license key'
+            '   License key: {}',
+            key,
             topic=INTERNALDATA
         )
         valid = self.validate_key(key)
         if not valid:
             Log.warning(
-                f'Key is of incorrect format'
+                'Key is of incorrect format'
             )
             return 'Key is of incorrect format'
 
@@ -295,23 +1009,29 @@ class LicenseManager:
         # create new License instance with key
         try:
             # all initialization + LicenseSpring calls happen in License __init__
-            new_license = License(key)
+            # a key added again keeps what we know about it
+            known = self.licenses.get(key)
+            if known is not None:
+                new_license = License(key, product=known.product, activated=known.activated)
+            else:
+                new_license = License(key)
         except:
             Log.warning(
-                f'License creation failed.'
-                f'   License key: {key}',
+                'License creation failed.'
+                '   License key: {}',
+                key,
                 topic=INTERNALDATA
             )
             raise CouldNotReachLicenseSpringException
 
         # add new license to registered licenses dict
-        self.licenses[key] = new_license
-
-        # clear and rewrite config file of registered keys
-        remove_persistent_config('license_keys')
-        write_persistent_config('license_keys', [*self.licenses.keys()])
+        with self.writing():
+            licenses = dict(self.licenses)
+            licenses[key] = new_license
+            self.publish(licenses)
+            self.save_state()
 
-        if not self.licenses[key].active:
+        if not new_license.active:
             return "Key registered, but could not activate"
 
         return key
@@ -338,8 +1058,9 @@ class LicenseManager:
         :return: Boolean
         """
         Log.debug(
-            f'License manager activate license.'
-            f'   License key: {license_key}',
+            'License manager activate license.'
+            '   License key: {}',
+            license_key,
             topic=INTERNALDATA
         )
         activated = False
@@ -358,13 +1079,14 @@ class LicenseManager:
         :return: List of keys
         """
         Log.debug(
-            f'License manager get keys.',
-            topic=INTERNALDATA
+            'License manager get keys.',
+            topic=INTERNALDATA,
+            sample=True
         )
 
-        # self.licenses is a dict keyed by license keys
+        # self.licenses is keyed by license keys
         # want to return those keys as a list
-        license_keys = [*self.licenses.keys()]
+        license_keys = [*self.state.licenses.keys()]
         return license_keys
 
     def get_licensed_behaviors(self):
@@ -387,12 +1109,13 @@ class LicenseManager:
         :return: four level dictionary
         """
         Log.debug(
-            f'License manager get all licensed features and behaviors',
-            topic=INTERNALDATA
+            'License manager get all licensed features and behaviors',
+            topic=INTERNALDATA,
+            sample=True
         )
         # build the return dict
         licensed_features = {}
-        for license_key, license_obj in self.licenses.items():
+        for license_key, license_obj in self.state.licenses.items():
             # only add active license features
             if license_obj.active:
                 for feature_name, feature_obj in license_obj.features.items():
@@ -416,18 +1139,19 @@ class LicenseManager:
         :return: List of dictionaries
         """
         Log.debug(
-            f'License manager get active licenses',
-            topic=INTERNALDATA
+            'License manager get active licenses',
+            topic=INTERNALDATA,
+            sample=True
         )
         active_keys = []
 
         # check every license key registered on QuikStation if active
-        for license_key in self.licenses:
-            if self.licenses[license_key].active:
+        for license_obj in self.state.licenses.values():
+            if license_obj.active:
                 k = {
-                    'license_key':self.licenses[license_key].license_key,
-                    'product':self.licenses[license_key].product,
-                    'features': [*self.licenses[license_key].features.keys()]
+                    'license_key':license_obj.license_key,
+                    'product':license_obj.product,
+                    'features': self.catalog.ordered(license_obj.product, license_obj.feature_codes)
                 }
 
                 active_keys.append(k)
@@ -440,24 +1164,25 @@ class LicenseManager:
         :return: Success message or error detail
         """
         Log.debug(
-            f'License manager remove all inactive keys',
+            'License manager remove all inactive keys',
             topic=INTERNALDATA
         )
-        inactive_keys = []
-        for license_key in self.licenses:
-            # if key not active, remove from registered dict
-            if not self.licenses[license_key].active:
-                inactive_keys.append(license_key)
+        with self.writing():
+            inactive_keys = []
+            for license_key in self.licenses:
+                # if key not active, remove from registered dict
+                if not self.licenses[license_key].active:
+                    inactive_keys.append(license_key)
 
-        if len(inactive_keys)==0:
-            return 'No inactive licenses found'
+            if len(inactive_keys)==0:
+                return 'No inactive licenses found'
 
-        for license_key in inactive_keys:
-            self.licenses.pop(license_key)
+            licenses = dict(self.licenses)
+            for license_key in inactive_keys:
+                licenses.pop(license_key)
+            self.publish(licenses)
 
-        # clear and rewrite config file
-        remove_persistent_config('license_keys')
-        write_persistent_config('license_keys', [*self.licenses.keys()])
+            self.save_state()
 
         return f'{len(inactive_keys)} inactive license(s) removed'
 
@@ -469,51 +1194,96 @@ class LicenseManager:
         :return: success message or error detail
         """
         Log.debug(
-            f'License manager remove key.'
-            f'   License key: {license_key}',
+            'License manager remove key.'
+            '   License key: {}',
+            license_key,
             topic=INTERNALDATA
         )
         # validate key
         valid = self.validate_key(license_key)
         if not valid:
             Log.warning(
-                f'Key is of incorrect format',
+                'Key is of incorrect format',
                 topic=INTERNALDATA
             )
             return 'Key is of incorrect format'
         license_key = license_key.upper()
 
-        # check if requested key is registered on QuikStation
-        keys = self.get_keys()
-        if license_key not in keys:
-            Log.warning(
-                f'License key {license_key} does not found'
-            )
-            return f'License key {license_key} not found'
+        with self.writing():
+            # check if requested key is registered on QuikStation
+            keys = self.get_keys()
+            if license_key not in keys:
+                Log.warning(
+                    'License key {} does not found',
+                    license_key
+                )
+                return f'License key {license_key} not found'
 
-        self.licenses.pop(license_key)
+            licenses = dict(self.licenses)
+            licenses.pop(license_key)
+            self.publish(licenses)
 
-        # clear and rewrite config file
-        remove_persistent_config('license_keys')
-        write_persistent_config('license_keys', [*self.licenses.keys()])
+            self.save_state()
 
         return f'License key {license_key} removed'
 
-    def update_licenses(self):
-        '''
-        update each registered license with current info from LicenseSpring
-        :return:
-        '''
+    def refresh_licenses(self, license_keys, pool):
+        """
+        Update the given licenses with current info from LicenseSpring and publish all results at once. \n
+        Each key is refreshed on a copy of its License. The copies are published together in one
+        new state, followed by a single save, so readers never see a half refreshed set.
+        A key whose refresh fails keeps its current state
+        :param license_keys: List of keys to refresh
+        :param pool: Executor to run the refreshes on
+        :return: Tuple of (dict key:change details for keys that changed, List of keys that failed to refresh)
+        """
         Log.debug(
-            f'License manager update all licenses',
+            'License manager refresh licenses.'
+            '   Keys: {}',
+            len(license_keys),
             topic=INTERNALDATA
         )
-        for license_key in self.licenses:
+        current = self.licenses
+        originals = {key: current[key] for key in license_keys if key in current}
+        futures = {pool.submit(license_obj.refreshed): key for key, license_obj in originals.items()}
+        refreshed = {}
+        failed = []
+        for future in as_completed(futures):
+            license_key = futures[future]
             try:
-                self.licenses[license_key].update_info()
-            except:
-                raise Exception
-        return "updated successfully"
+                refreshed[license_key] = future.result()
+            except (CouldNotReachLicenseSpringException, Exception) as e:
+                Log.warning(
+                    'License refresh failed.'
+                    '   License key: {}'
+                    '   Exception: {}',
+                    license_key,
+                    e,
+                    topic=INTERNALDATA
+                )
+                failed.append(license_key)
+
+        changes = {}
+        with self.writing():
+            licenses = dict(self.licenses)
+            for license_key, license_obj in refreshed.items():
+                # skip keys removed, or re-added, while their refresh was in flight
+                if licenses.get(license_key) is originals[license_key]:
+                    licenses[license_key] = license_obj
+                    change = license_obj.changes_since(originals[license_key])
+                    if change:
+                        changes[license_key] = change
+            # unchanged licenses only moved fetched_at, the index and version carry over
+            self.publish(licenses, changed=bool(changes))
+            self.save_state()
+        if changes:
+            Log.info(
+                'License refresh found changes.'
+                '   Changes: {}',
+                changes,
+                topic=INTERNALDATA
+            )
+        return changes, failed
 
 #
 # Importable instance.  Import this wherever we need it in the service.
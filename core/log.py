@@ -0,0 +1,141 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import threading
+import time
+
+from shared.ot_logging import SoaLogger
+from shared.local_config import read_local_static_config
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+# lines per second each sampled message may log
+DEFAULT_LOG_SAMPLE_RATE = 5
+
+
+class Lazy:
+    """
+    Argument computed only if the line it is passed to is actually logged, e.g.
+    Log.debug('Features: {}', Lazy(lambda: sorted(codes)), topic=ENABLEMENT)
+    """
+    __slots__ = ('fn',)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __format__(self, spec):
+        return format(self.fn(), spec)
+
+    def __str__(self):
+        return str(self.fn())
+
+    def __repr__(self):
+        return repr(self.fn())
+
+
+class ServiceLog:
+    """
+    SoaLogger behind a level and per-topic gate. \n
+    Messages are str.format templates and their arguments, formatted only once the line is known to be
+    logged, so a debug line below the configured level costs a call and a comparison. Per-request lines
+    pass sample=True and are limited to sample_rate lines per second per message and thread; the count of
+    lines dropped since is appended to the next one logged. Each thread keeps its own buckets, so sampling
+    takes no lock on the request path
+    """
+    def __init__(self):
+        # logs everything until configure(), SoaLogger filters as it always has
+        self.level = DEBUG
+        self.muted = frozenset()
+        self.sample_rate = DEFAULT_LOG_SAMPLE_RATE
+        # per thread: buckets, maps message template: [tokens, last refill, dropped], and the epoch they belong to
+        self.local = threading.local()
+        # bumped by configure(), threads start their buckets over when it moved
+        self.epoch = 0
+
+    def configure(self, level=None, topics=None, sample_rate=None):
+        '''
+        Set the gate, from static config for whatever isn't passed
+        :param level: 'debug', 'info', 'warning' or 'error'
+        :param topics: dict of topic:bool, topics mapped to False have their debug and info lines dropped
+        :param sample_rate: lines per second per sampled message
+        :return: nothing
+        '''
+        level = level or read_local_static_config('log_level') or 'info'
+        topics = topics if topics is not None else read_local_static_config('log_topics') or {}
+        self.level = LEVELS.get(str(level).lower(), INFO)
+        self.muted = frozenset(topic for topic, enabled in topics.items() if not enabled)
+        self.sample_rate = sample_rate or read_local_static_config('log_sample_rate') or DEFAULT_LOG_SAMPLE_RATE
+        self.epoch += 1
+
+    def enabled(self, level, topic=None):
+        '''
+        Whether a line at this level and topic would be logged, for guarding work done only to log it
+        '''
+        if level < self.level:
+            return False
+        return level >= WARNING or topic not in self.muted
+
+    def debug(self, msg, *args, topic=None, sample=False):
+        if DEBUG < self.level or topic in self.muted:
+            return
+        self.emit(SoaLogger.debug, msg, args, topic, sample)
+
+    def info(self, msg, *args, topic=None, sample=False):
+        if INFO < self.level or topic in self.muted:
+            return
+        self.emit(SoaLogger.info, msg, args, topic, sample)
+
+    def warning(self, msg, *args, topic=None):
+        if WARNING < self.level:
+            return
+        self.emit(SoaLogger.warning, msg, args, topic, False)
+
+    def error(self, msg, *args, topic=None):
+        self.emit(SoaLogger.error, msg, args, topic, False)
+
+    def emit(self, write, msg, args, topic, sample):
+        dropped = 0
+        if sample:
+            dropped = self.admit(msg)
+            if dropped is None:
+                return
+        text = msg.format(*args) if args else msg
+        if dropped:
+            text = f'{text}   ({dropped} similar lines dropped)'
+        if topic is None:
+            write(text)
+        else:
+            write(text, topic=topic)
+
+    def admit(self, key):
+        '''
+        Token bucket per message, in the calling thread's buckets
+        :return: lines dropped since the last one admitted, None if this one is dropped too
+        '''
+        local = self.local
+        if getattr(local, 'epoch', None) != self.epoch:
+            local.buckets = {}
+            local.epoch = self.epoch
+        now = time.monotonic()
+        rate = self.sample_rate
+        bucket = local.buckets.get(key)
+        if bucket is None:
+            bucket = local.buckets[key] = [rate, now, 0]
+        tokens = min(rate, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return None
+        bucket[0] = tokens - 1
+        dropped, bucket[2] = bucket[2], 0
+        return dropped
+
+
+#
+# Importable instance.  Import this wherever we need it in the service.
+#
+log = ServiceLog()
@@ -0,0 +1,219 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import threading
+import time
+
+from bisect import bisect_left
+
+from flask import g, request
+
+# histogram bucket upper bounds, seconds. Fixed, so recording is a bisect and an increment
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf')
+)
+
+
+def bucket_percentile(counts, count, fraction):
+    '''
+    Upper bound of the bucket the given fraction of observations falls in
+    '''
+    rank = count * fraction
+    seen = 0
+    for bound, n in zip(BUCKETS, counts):
+        seen += n
+        if seen >= rank:
+            return bound
+    return BUCKETS[-1]
+
+
+class Histogram:
+    """
+    Latency histogram over fixed buckets, with count and sum. \n
+    Percentiles are read off the buckets, so they are the bucket's upper bound, not exact.
+    Only ever written by one thread, see Metrics
+    """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        '''
+        Add other's observations to this histogram
+        :return: nothing
+        '''
+        for index, n in enumerate(list(other.counts)):
+            self.counts[index] += n
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def snapshot(self):
+        '''
+        :return: dict of count, sum, max, p50/p90/p99 (bucket bounds) and the non-empty buckets
+        '''
+        counts = self.counts
+        count, total, highest = self.count, self.sum, round(self.max, 6)
+        if not count:
+            return {'count': 0}
+        return {
+            'count': count,
+            'sum_seconds': round(total, 6),
+            'max_seconds': highest,
+            'p50_seconds': min(bucket_percentile(counts, count, 0.50), highest),
+            'p90_seconds': min(bucket_percentile(counts, count, 0.90), highest),
+            'p99_seconds': min(bucket_percentile(counts, count, 0.99), highest),
+            'buckets': {
+                ('+inf' if bound == float('inf') else str(bound)): n
+                for bound, n in zip(BUCKETS, counts) if n
+            },
+        }
+
+
+class Shard:
+    """
+    One thread's counters and histograms
+    """
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}
+
+    def merge(self, other):
+        for name, value in dict(other.counters).items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, histogram in dict(other.histograms).items():
+            self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+
+class Metrics:
+    """
+    Counters and latency histograms for the whole service, kept in memory and always on. \n
+    Names are dotted strings; labels are part of the name (e.g. 'licensespring.check_license.qsiscsi'), so
+    callers must only build names from bounded sets: route templates, operations, products, status classes. \n
+    Every thread records into its own Shard, so recording takes no lock and request threads never wait on
+    each other. Shards are summed when the metrics are read. Those of finished threads are folded into
+    self.retired then, and whenever a new thread registers its shard, so short-lived threads (socket
+    connections, pool workers) don't pile up between reads
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.retired = Shard(None)
+        # guards self.shards and self.retired, only taken by a thread's first record and by readers
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard(threading.current_thread())
+            with self.lock:
+                self.retire()
+                self.shards.append(shard)
+        return shard
+
+    def retire(self):
+        '''
+        Fold the shards of finished threads into self.retired and forget them. Caller must hold self.lock
+        :return: nothing
+        '''
+        live = []
+        for shard in self.shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                self.retired.merge(shard)
+        self.shards = live
+
+    def incr(self, name, amount=1):
+        counters = self.shard().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        histograms = self.shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def totals(self):
+        '''
+        Sum of every thread's shard
+        :return: Shard
+        '''
+        total = Shard(None)
+        with self.lock:
+            self.retire()
+            total.merge(self.retired)
+            for shard in self.shards:
+                total.merge(shard)
+        return total
+
+    def ratio(self, hits, misses, counters=None):
+        '''
+        :param counters: summed counters to read, from a snapshot. Summed here if None
+        :return: hits / (hits + misses) of the two counters, None before either was counted
+        '''
+        if counters is None:
+            counters = self.totals().counters
+        hit = counters.get(hits, 0)
+        total = hit + counters.get(misses, 0)
+        return round(hit / total, 4) if total else None
+
+    def snapshot(self):
+        '''
+        :return: dict of uptime, counters and histogram snapshots
+        '''
+        total = self.totals()
+        return {
+            'uptime_seconds': round(time.time() - self.started),
+            'counters': dict(sorted(total.counters.items())),
+            'histograms': {name: total.histograms[name].snapshot() for name in sorted(total.histograms)},
+        }
+
+    def reset(self):
+        with self.lock:
+            for shard in self.shards:
+                shard.counters.clear()
+                shard.histograms.clear()
+            self.retired = Shard(None)
+            self.started = time.time()
+
+
+def instrument(app, metrics):
+    '''
+    Time every request the Flask app serves, per route template and method
+    :return: nothing
+    '''
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            name = f'http.{request.method} {rule}'
+            metrics.observe(name, time.perf_counter() - started)
+            metrics.incr(f'{name}.{response.status_code // 100}xx')
+        return response
+
+
+#
+# Importable instance.  Import this wherever we need it in the service.
+#
+metrics = Metrics()
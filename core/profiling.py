@@ -0,0 +1,303 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from flask import g, request
+
+from .log import log as Log
+from .log_topics import INTERNALDATA
+
+# what a profiling session looks at
+ROUTES = 'routes'                  # requests to one route, or all of them
+LICENSESPRING = 'licensespring'    # check_license / activate_license calls
+
+# bounds for a session, so a forgotten one stops by itself
+MAX_SECONDS = 600
+MAX_REQUESTS = 10000
+
+# lines of each section in the report
+REPORT_FUNCTIONS = 40
+REPORT_ALLOCATIONS = 25
+
+
+def deep_size(obj, seen):
+    '''
+    Bytes held by obj and everything it references that hasn't been counted yet
+    '''
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, slot, None), seen) for slot in obj.__slots__)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def license_footprints(licenses):
+    '''
+    Memory held by each License, not counting what it shares with licenses listed before it
+    :param licenses: dict of key:License
+    :return: List of (key, product, bytes), largest first
+    '''
+    seen = set()
+    sizes = [
+        (license_key, license_obj.product, deep_size(license_obj, seen))
+        for license_key, license_obj in licenses.items()
+    ]
+    return sorted(sizes, key=lambda entry: entry[2], reverse=True)
+
+
+class Profiler:
+    """
+    On-demand cProfile (and optionally tracemalloc) sessions on a live service. \n
+    A session covers the next `requests` matching calls or `seconds`, whichever ends first, profiling
+    every `sample_every`th one. Only one call is profiled at a time; calls arriving while another one is
+    being profiled run unprofiled. While no session is active the only cost is reading self.active
+    """
+    def __init__(self):
+        self.active = False
+        self.target = None
+        self.route = None
+        self.remaining = 0
+        self.deadline = 0
+        self.sample_every = 1
+        self.memory = False
+
+        self.seen = 0
+        self.profiled = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.stats = None
+        self.allocations = None
+
+        self.lock = threading.Lock()
+        # held while a call is being profiled
+        self.busy = threading.Lock()
+
+    def start(self, target, route=None, requests=None, seconds=None, sample_every=1, memory=False):
+        '''
+        Start a session, replacing the results of the last one
+        :param target: ROUTES or LICENSESPRING
+        :param route: route template to profile, e.g. '/licenseinfo/<behavior_name>'. All routes if None
+        :param requests: stop after profiling this many calls
+        :param seconds: stop after this many seconds
+        :param sample_every: profile one call in this many
+        :param memory: also trace allocations with tracemalloc
+        :return: status dict
+        '''
+        if target not in (ROUTES, LICENSESPRING):
+            raise ValueError(f'Unknown profiling target {target}')
+        with self.lock:
+            if self.active:
+                self.finish()
+            self.target = target
+            self.route = route
+            self.remaining = min(requests or MAX_REQUESTS, MAX_REQUESTS)
+            self.deadline = time.monotonic() + min(seconds or MAX_SECONDS, MAX_SECONDS)
+            self.sample_every = max(1, sample_every or 1)
+            self.memory = memory
+            self.seen = 0
+            self.profiled = 0
+            self.started_at = time.time()
+            self.stopped_at = None
+            self.stats = None
+            self.allocations = None
+            if memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.active = True
+        Log.info(
+            'Profiling started.'
+            '   Target: {}'
+            '   Route: {}'
+            '   Requests: {}'
+            '   Sample every: {}'
+            '   Memory: {}',
+            target,
+            route,
+            self.remaining,
+            self.sample_every,
+            memory,
+            topic=INTERNALDATA
+        )
+        return self.status()
+
+    def stop(self):
+        '''
+        End the session, results stay available for report()
+        :return: status dict
+        '''
+        with self.lock:
+            if self.active:
+                self.finish()
+        return self.status()
+
+    def finish(self):
+        # caller holds self.lock
+        self.active = False
+        self.stopped_at = time.time()
+        if self.memory and tracemalloc.is_tracing():
+            self.allocations = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            tracemalloc.stop()
+        Log.info(
+            'Profiling stopped.'
+            '   Profiled: {}'
+            '   Seen: {}',
+            self.profiled,
+            self.seen,
+            topic=INTERNALDATA
+        )
+
+    def wants(self, target, route=None):
+        '''
+        Whether to profile this call. Only called while self.active
+        '''
+        if target != self.target or (self.route is not None and route != self.route):
+            return False
+        if time.monotonic() > self.deadline:
+            self.stop()
+            return False
+        with self.lock:
+            self.seen += 1
+            return self.seen % self.sample_every == 0
+
+    def begin(self):
+        '''
+        :return: enabled cProfile.Profile, or None if another call is being profiled
+        '''
+        if not self.busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def end(self, profile):
+        profile.disable()
+        self.busy.release()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.profiled += 1
+            self.remaining -= 1
+            if self.remaining <= 0 and self.active:
+                self.finish()
+
+    def call(self, fn, *args, **kwargs):
+        '''
+        Run fn, profiled if the session wants it
+        '''
+        if not self.active or not self.wants(LICENSESPRING):
+            return fn(*args, **kwargs)
+        profile = self.begin()
+        if profile is None:
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.end(profile)
+
+    def status(self):
+        status = {
+            'active': self.active,
+            'target': self.target,
+            'route': self.route,
+            'profiled': self.profiled,
+            'seen': self.seen,
+            'memory': self.memory,
+        }
+        if self.active:
+            status['remaining'] = self.remaining
+            status['seconds_left'] = round(max(0.0, self.deadline - time.monotonic()), 1)
+        return status
+
+    def report(self, licenses=None):
+        '''
+        Text report of the last (or current) session
+        :param licenses: dict of key:License, for the per-License memory footprint
+        :return: String
+        '''
+        out = io.StringIO()
+        status = self.status()
+        out.write('License Manager profile\n')
+        for name, value in status.items():
+            out.write(f'  {name}: {value}\n')
+        if self.started_at:
+            out.write(f'  started: {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at))}\n')
+
+        out.write(f'\n== cProfile, top {REPORT_FUNCTIONS} by cumulative time\n')
+        with self.lock:
+            if self.stats is not None:
+                stats = pstats.Stats(stream=out)
+                stats.add(self.stats)
+                stats.sort_stats('cumulative').print_stats(REPORT_FUNCTIONS)
+            else:
+                out.write('no calls profiled\n')
+
+        if self.allocations is not None:
+            out.write(f'\n== tracemalloc, top {REPORT_ALLOCATIONS} lines by memory allocated during the session\n')
+            for stat in self.allocations.statistics('lineno')[:REPORT_ALLOCATIONS]:
+                out.write(f'{stat}\n')
+        elif self.memory:
+            out.write('\n== tracemalloc: session still running, stop it for allocations\n')
+
+        if licenses is not None:
+            footprints = license_footprints(licenses)
+            total = sum(size for _, _, size in footprints)
+            out.write(f'\n== License memory footprint, {len(footprints)} licenses, {total} bytes\n')
+            for license_key, product, size in footprints:
+                out.write(f'{license_key}  {product or "-":20} {size:>8} bytes\n')
+        return out.getvalue()
+
+    def dump(self):
+        '''
+        Raw profile of the session, in the format pstats.Stats / snakeviz load from a file
+        :return: bytes, empty if nothing was profiled
+        '''
+        with self.lock:
+            if self.stats is None:
+                return b''
+            return marshal.dumps(self.stats.stats)
+
+
+def instrument(app, profiler):
+    '''
+    Let profiling sessions cover the Flask app's requests
+    :return: nothing
+    '''
+    @app.before_request
+    def start_profile():
+        if not profiler.active:
+            return
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        if rule is None or rule.startswith('/admin/profiling'):
+            return
+        if profiler.wants(ROUTES, rule):
+            g.profile = profiler.begin()
+
+    @app.teardown_request
+    def end_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profiler.end(profile)
+
+
+#
+# Importable instance.  Import this wherever we need it in the service.
+#
+profiler = Profiler()
@@ -0,0 +1,234 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.local_config import read_local_static_config
+
+from .license_check import license_manager
+from .license_check import DEFAULT_REFRESH_WORKERS
+from .log import log as Log
+from .log_topics import INTERNALDATA, ENABLEMENT
+from .metrics import metrics
+from .shared_state import REFRESH_REQUESTS_OFFSET, RETRY_REQUESTS_OFFSET
+
+# defaults for tunables that can be overridden in static_config.yaml
+DEFAULT_REFRESH_TTL = 24 * 60 * 60     # seconds a license's info is trusted before it is refreshed
+DEFAULT_REFRESH_JITTER = 0.1           # +/- fraction of the TTL, spreads a fleet's calls to LicenseSpring
+DEFAULT_REFRESH_RETRY = 5 * 60         # seconds before retrying a key whose refresh couldn't reach LicenseSpring
+
+# longest the scheduler sleeps between looks at the schedule, so new keys get picked up
+MAX_SLEEP = 60
+
+
+class RefreshScheduler:
+    """
+    Background thread that keeps every registered license fresh. \n
+    Each key is refreshed once its TTL (plus jitter) has passed since it was last fetched.
+    Due keys are refreshed together on a bounded worker pool and published in one swap
+    by LicenseManager.refresh_licenses()
+    """
+    def __init__(self):
+        self.ttl = DEFAULT_REFRESH_TTL
+        self.jitter = DEFAULT_REFRESH_JITTER
+        self.retry = DEFAULT_REFRESH_RETRY
+
+        # maps "key": epoch seconds when the key is next due
+        self.next_refresh = {}
+        # keys waiting on a retry, their last refresh couldn't reach LicenseSpring
+        self.retrying = set()
+
+        self.pool = None
+        self.thread = None
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.refresh_all = False
+        # what the last refresh did, for /metrics. None until the first one
+        self.last_run = None
+
+    def start(self):
+        '''
+        Read tunables and start the scheduler thread.
+        Called on enablement, after LicenseManager.setup()
+        :return: nothing
+        '''
+        self.ttl = read_local_static_config('refresh_ttl') or DEFAULT_REFRESH_TTL
+        self.jitter = read_local_static_config('refresh_jitter') or DEFAULT_REFRESH_JITTER
+        self.retry = read_local_static_config('refresh_retry') or DEFAULT_REFRESH_RETRY
+        Log.debug(
+            'Refresh scheduler start.'
+            '   TTL: {}'
+            '   Jitter: {}',
+            self.ttl,
+            self.jitter,
+            topic=ENABLEMENT
+        )
+        if self.thread is not None and self.thread.is_alive():
+            return
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(
+                max_workers=read_local_static_config('refresh_workers') or DEFAULT_REFRESH_WORKERS,
+                thread_name_prefix='license_refresh'
+            )
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='license_refresh_scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop the scheduler thread. A refresh already in flight is allowed to finish
+        :return: nothing
+        '''
+        self.stopping.set()
+        self.wake.set()
+
+    def forward(self, offset):
+        '''
+        In shared state mode, a process that doesn't own refresh passes the request on to the one that does
+        :param offset: shared_state request counter to bump
+        :return: Boolean, whether the request was forwarded
+        '''
+        shared = license_manager.shared
+        if shared is None or shared.is_owner():
+            return False
+        shared.request(offset)
+        return True
+
+    def trigger(self):
+        '''
+        Refresh every license now, without waiting for their TTLs. Does not block
+        :return: status message
+        '''
+        Log.debug(
+            'Refresh scheduler triggered.',
+            topic=INTERNALDATA
+        )
+        if self.forward(REFRESH_REQUESTS_OFFSET):
+            return 'license update requested successfully from the refreshing process'
+        self.refresh_all = True
+        self.wake.set()
+        return 'license update started successfully'
+
+    def retry_now(self):
+        '''
+        Refresh the keys waiting on a retry now, instead of after refresh_retry seconds. Does not block
+        :return: List of keys, empty when the request was passed on to the refreshing process
+        '''
+        if self.forward(RETRY_REQUESTS_OFFSET):
+            Log.debug(
+                'Refresh scheduler retry forwarded.',
+                topic=INTERNALDATA
+            )
+            return []
+        license_keys = sorted(self.retrying.copy())
+        Log.debug(
+            'Refresh scheduler retrying now.'
+            '   Keys: {}',
+            license_keys,
+            topic=INTERNALDATA
+        )
+        for license_key in license_keys:
+            if license_key in self.next_refresh:
+                self.next_refresh[license_key] = 0
+        self.wake.set()
+        return license_keys
+
+    def interval(self):
+        '''
+        TTL with jitter applied
+        :return: seconds
+        '''
+        return self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def due_keys(self, now):
+        '''
+        Registered keys whose refresh time has passed. Also schedules keys seen for the first time
+        and forgets removed ones
+        :param now: epoch seconds
+        :return: List of keys
+        '''
+        license_keys = license_manager.get_keys()
+        for license_key in [*self.next_refresh.keys()]:
+            if license_key not in license_keys:
+                self.next_refresh.pop(license_key)
+                self.retrying.discard(license_key)
+
+        for license_key in license_keys:
+            if license_key not in self.next_refresh:
+                license_obj = license_manager.licenses.get(license_key)
+                fetched_at = license_obj.fetched_at if license_obj is not None else 0
+                self.next_refresh[license_key] = fetched_at + self.interval() if fetched_at else now
+
+        if self.refresh_all:
+            self.refresh_all = False
+            return license_keys
+        return [key for key in license_keys if self.next_refresh[key] <= now]
+
+    def run(self):
+        '''
+        Scheduler loop. Sleeps until the next key is due or trigger() is called
+        :return: nothing
+        '''
+        # a warm start's revalidation is calling LicenseSpring for every key already, refreshing them
+        # alongside it would double the calls. Keys setup couldn't resolve wait for their retry
+        license_manager.revalidated.wait()
+        now = time.time()
+        for license_key in license_manager.hydration_failures:
+            self.next_refresh[license_key] = now + self.retry
+            self.retrying.add(license_key)
+
+        while not self.stopping.is_set():
+            self.wake.clear()
+            now = time.time()
+            due = self.due_keys(now)
+            if due:
+                started = time.monotonic()
+                try:
+                    changes, failed = license_manager.refresh_licenses(due, self.pool)
+                except Exception as e:
+                    Log.error('Scheduled license refresh failed.   Exception: {}', e, topic=INTERNALDATA)
+                    changes, failed = {}, due
+                metrics.observe('refresh', time.monotonic() - started)
+                metrics.incr('refresh.keys', len(due))
+                metrics.incr('refresh.changed', len(changes))
+                metrics.incr('refresh.failed', len(failed))
+                Log.debug(
+                    'Scheduled license refresh done.'
+                    '   Keys: {}'
+                    '   Changed: {}'
+                    '   Failed: {}'
+                    '   Seconds: {:.2f}',
+                    len(due),
+                    len(changes),
+                    len(failed),
+                    time.monotonic() - started,
+                    topic=INTERNALDATA
+                )
+                self.last_run = {
+                    'finished_at': int(time.time()),
+                    'seconds': round(time.monotonic() - started, 3),
+                    'keys': len(due),
+                    'changed': changes,
+                    'failed': sorted(failed),
+                }
+                now = time.time()
+                for license_key in due:
+                    if license_key in failed:
+                        # couldn't reach LicenseSpring, try again soon. A key every product rejected was
+                        # answered, it waits for its TTL like any other
+                        self.next_refresh[license_key] = now + self.retry
+                        self.retrying.add(license_key)
+                    else:
+                        self.next_refresh[license_key] = now + self.interval()
+                        self.retrying.discard(license_key)
+
+            sleep = min(self.next_refresh.values(), default=now + MAX_SLEEP) - time.time()
+            self.wake.wait(timeout=min(max(sleep, 1), MAX_SLEEP))
+
+
+#
+# Importable instance.  Import this wherever we need it in the service.
+#
+refresh_scheduler = RefreshScheduler()
@@ -0,0 +1,229 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+from contextlib import contextmanager
+
+from .log import log as Log
+from .log_topics import ENABLEMENT
+
+# file layout: header, then payload_length bytes of payload
+#   magic (4s), format (H), reserved (H), generation (Q), payload_length (Q),
+#   refresh_requests (Q), retry_requests (Q)
+HEADER = struct.Struct('<4sHHQQQQ')
+MAGIC = b'OTLS'
+FORMAT = 1
+GENERATION = struct.Struct('<Q')
+GENERATION_OFFSET = 8
+# counters non-owner processes bump to have the owner refresh for them
+COUNTER = struct.Struct('<Q')
+REFRESH_REQUESTS_OFFSET = 24
+RETRY_REQUESTS_OFFSET = 32
+
+# seconds between attempts of a non-owner process to take over ownership
+DEFAULT_TAKEOVER_INTERVAL = 30
+# seconds between the owner's looks at the request counters
+DEFAULT_REQUEST_POLL_INTERVAL = 1
+
+
+class SharedStateFile:
+    """
+    License state shared between the service's processes through a memory-mapped file. \n
+    Writers hold an exclusive lock on <path>.lock, write the payload, then bump the generation in
+    the header. Readers map the file read-only and compare the generation on every read, which is
+    a few bytes of shared memory. Only when it moved do they take the lock (shared) and reload.
+    The file only ever grows, so a reader's mapping is never left pointing past its end. \n
+    Separately, one process at a time holds <path>.owner and is the only one talking to
+    LicenseSpring for refreshes. The others ask it for one by bumping a request counter in the header
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o640)
+        self.lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o640)
+        self.owner_fd = None
+        self.watcher = None
+        self.request_watcher = None
+        # flock is held per open file, not per thread: threads of this process take turns on it
+        self.thread_lock = threading.RLock()
+        self.lock_depth = 0
+
+        with self.locked():
+            if os.fstat(self.fd).st_size < HEADER.size:
+                os.pwrite(self.fd, HEADER.pack(MAGIC, FORMAT, 0, 0, 0, 0, 0), 0)
+
+        self.map = None
+        self.map_lock = threading.Lock()
+        self.remap()
+
+    def remap(self):
+        '''
+        Map the whole file, read-only. Called when the payload outgrew the current mapping
+        :return: nothing
+        '''
+        with self.map_lock:
+            size = os.fstat(self.fd).st_size
+            if self.map is not None and len(self.map) >= size:
+                return
+            self.map = mmap.mmap(self.fd, size, prot=mmap.PROT_READ)
+
+    def close(self):
+        '''
+        Unmap and close the file, giving up ownership if this process held it
+        :return: nothing
+        '''
+        with self.map_lock:
+            self.map.close()
+        for fd in (self.fd, self.lock_fd, self.owner_fd):
+            if fd is not None:
+                os.close(fd)
+        self.owner_fd = None
+
+    @contextmanager
+    def locked(self, shared=False):
+        '''
+        Hold the cross-process lock. Exclusive for writers, shared for readers.
+        Re-entrant, a nested call keeps the lock taken by the outer one
+        '''
+        with self.thread_lock:
+            if self.lock_depth:
+                self.lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self.lock_depth -= 1
+                return
+            fcntl.flock(self.lock_fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self.lock_depth = 1
+            try:
+                yield
+            finally:
+                self.lock_depth = 0
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def generation(self):
+        '''
+        Current generation, straight from the mapping. Bumped by every write
+        :return: int
+        '''
+        return GENERATION.unpack_from(self.map, GENERATION_OFFSET)[0]
+
+    def read(self):
+        '''
+        Read the current payload
+        :return: Tuple of (generation, payload bytes), payload is empty if nothing was written yet
+        '''
+        with self.locked(shared=True):
+            magic, file_format, _, generation, length, _, _ = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or file_format != FORMAT:
+                raise ValueError(f'{self.path} is not a license state file this service can read')
+            if HEADER.size + length > len(self.map):
+                self.remap()
+            return generation, bytes(self.map[HEADER.size:HEADER.size + length])
+
+    def write(self, payload):
+        '''
+        Replace the payload and bump the generation. Caller must hold locked()
+        :param payload: bytes
+        :return: the new generation
+        '''
+        generation = self.generation() + 1
+        refresh_requests = COUNTER.unpack_from(self.map, REFRESH_REQUESTS_OFFSET)[0]
+        retry_requests = COUNTER.unpack_from(self.map, RETRY_REQUESTS_OFFSET)[0]
+        if os.fstat(self.fd).st_size < HEADER.size + len(payload):
+            os.ftruncate(self.fd, HEADER.size + len(payload))
+        os.pwrite(self.fd, payload, HEADER.size)
+        # header last, readers going by the generation never see it ahead of its payload
+        header = HEADER.pack(MAGIC, FORMAT, 0, generation, len(payload), refresh_requests, retry_requests)
+        os.pwrite(self.fd, header, 0)
+        self.remap()
+        return generation
+
+    def request(self, offset):
+        '''
+        Ask the owner process for a refresh by bumping one of the request counters
+        :param offset: REFRESH_REQUESTS_OFFSET or RETRY_REQUESTS_OFFSET
+        :return: nothing
+        '''
+        with self.locked():
+            count = COUNTER.unpack_from(self.map, offset)[0] + 1
+            os.pwrite(self.fd, COUNTER.pack(count), offset)
+
+    def requests(self):
+        '''
+        Request counters, straight from the mapping
+        :return: Tuple of (refresh requests, retry requests)
+        '''
+        return (
+            COUNTER.unpack_from(self.map, REFRESH_REQUESTS_OFFSET)[0],
+            COUNTER.unpack_from(self.map, RETRY_REQUESTS_OFFSET)[0]
+        )
+
+    def is_owner(self):
+        return self.owner_fd is not None
+
+    def try_acquire_ownership(self):
+        '''
+        Try to become the process that refreshes from LicenseSpring. Ownership lasts as long as
+        the process does, the OS releases it when the process exits
+        :return: Boolean, whether this process is (now) the owner
+        '''
+        if self.owner_fd is not None:
+            return True
+        fd = os.open(self.path + '.owner', os.O_RDWR | os.O_CREAT, 0o640)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.owner_fd = fd
+        Log.info('Process {} owns license refresh', os.getpid(), topic=ENABLEMENT)
+        return True
+
+    def watch_ownership(self, on_acquired, interval=DEFAULT_TAKEOVER_INTERVAL):
+        '''
+        In a non-owner process, keep trying to take ownership in the background, so refresh
+        carries on if the owning process goes away
+        :param on_acquired: called once, from the watcher thread, when ownership is taken
+        :return: nothing
+        '''
+        if self.watcher is not None and self.watcher.is_alive():
+            return
+
+        def watch():
+            stop = threading.Event()
+            while not self.try_acquire_ownership():
+                stop.wait(interval)
+            on_acquired()
+
+        self.watcher = threading.Thread(target=watch, name='license_ownership_watch', daemon=True)
+        self.watcher.start()
+
+    def watch_requests(self, on_refresh, on_retry, interval=DEFAULT_REQUEST_POLL_INTERVAL):
+        '''
+        In the owner process, act on the refreshes other processes ask for. Requests made before
+        this is called are not replayed, taking ownership resolves every license anyway
+        :param on_refresh: called from the watcher thread when a refresh of every license was asked for
+        :param on_retry: called from the watcher thread when a retry of unreachable keys was asked for
+        :return: nothing
+        '''
+        if self.request_watcher is not None and self.request_watcher.is_alive():
+            return
+
+        def watch():
+            stop = threading.Event()
+            seen_refresh, seen_retry = self.requests()
+            while True:
+                stop.wait(interval)
+                refresh_requests, retry_requests = self.requests()
+                if refresh_requests != seen_refresh:
+                    seen_refresh = refresh_requests
+                    on_refresh()
+                if retry_requests != seen_retry:
+                    seen_retry = retry_requests
+                    on_retry()
+
+        self.request_watcher = threading.Thread(target=watch, name='license_request_watch', daemon=True)
+        self.request_watcher.start()
@@ -1,8 +1,23 @@
 # Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
-from shared.ot_logging import SoaLogger as Log
+import queue
+import threading
+
 from shared.soa_service import SoaService
+from shared.local_config import read_local_static_config
 
 from .license_check import license_manager
+from .log import log as Log
+from .refresh import refresh_scheduler
+from .shared_state import DEFAULT_TAKEOVER_INTERVAL
+from .shared_state import DEFAULT_REQUEST_POLL_INTERVAL
+
+# broadcast whenever the set of licensed behaviors changes, data is
+#   {'added': [behavior names], 'removed': [behavior names], 'version': state version,
+#    'previous_version': version of the previous broadcast, 'boot_id': boot id}
+# versions in between changed licenses but not behaviors, so they are never broadcast
+# consumers can keep their own entitlement cache and apply these instead of polling /licenseinfo/<behavior_name>
+ENTITLEMENTS_CHANGED = 'entitlements_changed'
+
 
 class ThisService(SoaService):
 
@@ -20,12 +35,95 @@ class ThisService(SoaService):
 
     # required override
     def send_broadcast_events(self):
+        # entitlement changes are sent by broadcast_loop, their only consumer, so they go out in version order
         pass
 
+    def broadcast_entitlements(self, data):
+        Log.debug(
+            'Broadcasting {}.'
+            '   Added: {}'
+            '   Removed: {}'
+            '   State version: {}',
+            ENTITLEMENTS_CHANGED,
+            data["added"],
+            data["removed"],
+            data["version"]
+        )
+        try:
+            self.send_broadcast_event(ENTITLEMENTS_CHANGED, data)
+        except Exception as e:
+            Log.warning('Could not broadcast {}: {}', ENTITLEMENTS_CHANGED, e)
+
+    def entitlements_changed(self, added, removed, version, previous_version):
+        """
+        license_manager listener. Queues the change, it is broadcast from the event thread so
+        writers never wait on the broadcast
+        """
+        self.pending_events.put({
+            'added': added,
+            'removed': removed,
+            'version': version,
+            'previous_version': previous_version,
+            'boot_id': license_manager.boot_id
+        })
+
+    def broadcast_loop(self):
+        """
+        Broadcast queued entitlement changes as they come. The one thread sending them keeps them in
+        the order they were published, which clients chaining previous_version depend on
+        """
+        while True:
+            self.broadcast_entitlements(self.pending_events.get())
+
     # override
     def custom_enable(self):
+        Log.configure()
         Log.info('Enabling the Service')
-        license_manager.setup()
+        if getattr(self, 'pending_events', None) is None:
+            self.pending_events = queue.Queue()
+            license_manager.add_listener(self.entitlements_changed)
+            threading.Thread(target=self.broadcast_loop, name='license_events', daemon=True).start()
+        shared_state_path = read_local_static_config('shared_state_path')
+        if shared_state_path:
+            shared = license_manager.enable_shared_state(shared_state_path)
+            if not shared.try_acquire_ownership():
+                # another process refreshes from LicenseSpring, this one serves the state it publishes
+                Log.info('License refresh owned by another process')
+                license_manager.setup_client()
+                shared.watch_ownership(
+                    self.start_licensing,
+                    read_local_static_config('shared_state_takeover_interval') or DEFAULT_TAKEOVER_INTERVAL
+                )
+                return
+        self.start_licensing()
+
+    def start_licensing(self):
+        """
+        Resolve the registered licenses, start refreshing them and listen on the local socket.
+        Only ever runs in one process, when license state is shared
+        """
+        failures = license_manager.setup()
+        if failures:
+            Log.warning('Service enabled, but {} license key(s) could not be resolved: {}', len(failures), [*failures.keys()])
+        refresh_scheduler.start()
+        if license_manager.shared is not None:
+            # refreshes asked for through the other processes
+            license_manager.shared.watch_requests(
+                refresh_scheduler.trigger,
+                refresh_scheduler.retry_now,
+                read_local_static_config('shared_state_request_poll') or DEFAULT_REQUEST_POLL_INTERVAL
+            )
+
+        local_socket_path = read_local_static_config('local_socket_path')
+        if local_socket_path:
+            # imported here, the listener answers through this_service
+            from ..apis.local_socket import local_listener
+            from ..apis.local_socket import DEFAULT_LOCAL_SOCKET_TIMEOUT, DEFAULT_LOCAL_SOCKET_CONNECTIONS
+            local_listener.start(
+                local_socket_path,
+                read_local_static_config('local_socket_timeout') or DEFAULT_LOCAL_SOCKET_TIMEOUT,
+                read_local_static_config('local_socket_max_connections') or DEFAULT_LOCAL_SOCKET_CONNECTIONS
+            )
 
 
 #
@@ -0,0 +1,139 @@
+# Copyright @ 2023 Overland Storage, Inc. dba Overland-Tandberg. All rights reserved.
+import time
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from licensespring.api import APIClient
+from licensespring.api import ClientError
+
+from .log import log as Log
+from .log_topics import INTERNALDATA
+from .metrics import metrics
+from .profiling import profiler
+from .call_policy import RetryBudget, build_policies
+from .call_policy import DEFAULT_RETRY_BUDGET_RATIO, DEFAULT_RETRY_BUDGET_MAX
+from .circuit_breaker import CircuitBreaker
+from .circuit_breaker import DEFAULT_BREAKER_FAILURE_THRESHOLD, DEFAULT_BREAKER_RESET_TIMEOUT
+
+# defaults for tunables that can be overridden in static_config.yaml
+DEFAULT_HTTP_POOL_SIZE = 15        # matches threads=15 in soa_license_manager.conf
+DEFAULT_HTTP_CONNECT_TIMEOUT = 5   # seconds
+DEFAULT_HTTP_READ_TIMEOUT = 15     # seconds
+
+
+class PooledAPIClient(APIClient):
+    """
+    LicenseSpring APIClient that sends every call through one shared keep-alive session. \n
+    The stock client opens a new connection (and TLS handshake) per call. Here connections are
+    kept in a pool sized for the service's threads, every call gets connect/read timeouts,
+    and the time spent on each endpoint is recorded in the service metrics. \n
+    check_license and activate_license additionally run under their CallPolicy (retries, hedging),
+    see call_policy.py, behind a circuit breaker that fails them fast while LicenseSpring is down
+    """
+    def __init__(self, pool_size=DEFAULT_HTTP_POOL_SIZE,
+                 connect_timeout=DEFAULT_HTTP_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_HTTP_READ_TIMEOUT,
+                 call_policies=None,
+                 retry_budget_ratio=DEFAULT_RETRY_BUDGET_RATIO,
+                 retry_budget_max=DEFAULT_RETRY_BUDGET_MAX,
+                 breaker_failure_threshold=DEFAULT_BREAKER_FAILURE_THRESHOLD,
+                 breaker_reset_timeout=DEFAULT_BREAKER_RESET_TIMEOUT,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = (connect_timeout, read_timeout)
+
+        # one retry budget for all operations, an outage affects them all
+        self.retry_budget = RetryBudget(retry_budget_ratio, retry_budget_max)
+        self.hedge_pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='licensespring_hedge')
+        self.policies = build_policies(call_policies, self.retry_budget, self.hedge_pool)
+        # outside the policies, so an open breaker skips retries and hedges too
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+
+        # pool_block: callers wait for a free connection instead of opening throwaway ones
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def check_license(self, *args, **kwargs):
+        return self.guarded('check', super().check_license, *args, **kwargs)
+
+    def activate_license(self, *args, **kwargs):
+        return self.guarded('activate', super().activate_license, *args, **kwargs)
+
+    def guarded(self, operation, fn, *args, **kwargs):
+        '''
+        Run a LicenseSpring call under its policy and the breaker, profiled if a profiling session wants it
+        :return: whatever fn returns
+        '''
+        if profiler.active:
+            return profiler.call(self.breaker.call, self.policies[operation].call, fn, *args, **kwargs)
+        return self.breaker.call(self.policies[operation].call, fn, *args, **kwargs)
+
+    def send_request(self, method, endpoint, custom_headers={}, params=None, data=None, json_data=None):
+        '''
+        Same contract as APIClient.send_request, over the pooled session. The stock one calls requests.request
+        directly, so there is no session to hand it. Mirrors APIClient.send_request of licensespring 4.0.0,
+        pinned in python_deps.yaml: recheck this before moving the pin
+        :return: requests.Response
+        '''
+        started = time.monotonic()
+        product = (params or json_data or {}).get('product')
+        error = 'unknown'
+        try:
+            response = self.session.request(
+                method=method,
+                url=self.api_url(endpoint),
+                headers=self.request_headers(custom_headers=custom_headers),
+                params=params,
+                data=data,
+                json=json_data,
+                timeout=self.timeout,
+            )
+
+            if 400 <= response.status_code < 500:
+                if response.json().get("code") in ["oauth_token_expired", "oauth_token_malformed"]:
+                    self.update_bearer_token()
+                    error = None
+                    return self.send_request(
+                        method=method,
+                        endpoint=endpoint,
+                        custom_headers=custom_headers,
+                        params=params,
+                        data=data,
+                        json_data=json_data,
+                    )
+                raise ClientError(response)
+            response.raise_for_status()
+            error = None
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(endpoint, time.monotonic() - started, error, product)
+
+    def record(self, endpoint, seconds, error, product=None):
+        '''
+        Add one call to the service metrics
+        :param error: class name of the exception the call failed with, None if it succeeded
+        :return: nothing
+        '''
+        failed = error is not None
+        name = f'licensespring{endpoint.replace("/", ".")}.{product or "none"}'
+        metrics.observe(name, seconds)
+        if failed:
+            metrics.incr(f'{name}.errors.{error}')
+        Log.debug(
+            'LicenseSpring call.'
+            '   Endpoint: {}'
+            '   Seconds: {:.3f}'
+            '   Error: {}',
+            endpoint,
+            seconds,
+            error,
+            topic=INTERNALDATA
+        )
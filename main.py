@@ -28,6 +28,11 @@ from .apis.event import ns as ns_events
 from .core.this_service import this_service
 from .apis.license_info import ns as ns_license
 from .apis.commands import ns as ns_commands
+from .apis.metrics import ns as ns_metrics
+from .apis.profiling import ns as ns_profiling
+from .apis.fast_path import BehaviorFastPath
+from .core.metrics import metrics, instrument
+from .core.profiling import profiler, instrument as instrument_profiling
 
 
 #
@@ -35,6 +40,9 @@ from .apis.commands import ns as ns_commands
 #
 app = Flask(__name__)  # Flask app instance initiated
 app.config['RESTX_MASK_SWAGGER'] = False  # We don't need to mask out fields in this example.
+instrument(app, metrics)  # per-endpoint latency histograms, see GET /metrics
+instrument_profiling(app, profiler)  # on-demand profiling, see /admin/profiling
+app.wsgi_app = BehaviorFastPath(app.wsgi_app)  # GET /licenseinfo/fast/<behavior_name> without Flask
 
 #
 # Template Note: Update the title and description below for this SOA service.  These are top-level
@@ -56,6 +64,8 @@ api.add_namespace(shared_ns_admin, path='/admin')
 api.add_namespace(ns_events, path='/events')
 api.add_namespace(ns_license, path='/licenseinfo')
 api.add_namespace(ns_commands, path='/commands')
+api.add_namespace(ns_metrics, path='/metrics')
+api.add_namespace(ns_profiling, path='/admin/profiling')
 
 if __name__ == '__main__':
     app.run(